@@ -0,0 +1,89 @@
+import argparse
+import json
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from batch_scoring import StatusColumns, AffinityMatrix, score_feeds
+from feed import FeedIndex
+from main import calculate_status_weight
+from ranking import RankingContext
+from snapshot import Snapshot
+
+_snapshot = None
+_feed_index = None
+
+def _init_worker(path, n, now, recent_per_author, prune_factor):
+    # every worker maps the same snapshot file, the graph and statuses are shared through the page cache instead of pickled
+    global _snapshot, _feed_index
+    _snapshot = Snapshot(path)
+    _feed_index = FeedIndex(_snapshot.graph, _snapshot.statuses, calculate_status_weight, n, context = RankingContext(now),
+                            recent_per_author = recent_per_author, prune_factor = prune_factor)
+
+def _feed_chunk(users):
+    return [(user, _feed_index.build_feed(user)) for user in users]
+
+def chunked(users, size):
+    for start in range(0, len(users), size):
+        yield users[start:start + size]
+
+def vectorized_feeds(path, users, n, now, chunk_size):
+    # exact feeds scored a block of users at a time with numpy in this process, instead of FeedIndex in workers
+    snapshot = Snapshot(path)
+    columns = StatusColumns.from_snapshot(snapshot, RankingContext(now))
+    for chunk in chunked(users, chunk_size):
+        yield list(score_feeds(columns, AffinityMatrix(snapshot.graph, chunk, columns.authors), n))
+
+def run_batch(path, output, users = None, n = 10, processes = None, chunk_size = 1000, now = None, recent_per_author = None, prune_factor = 1.0,
+              vectorized = False):
+    # writes one json line with the user and the ids of their top n statuses per user, in the order of users;
+    # now re-ranks the statuses only, the edge weights stay decayed as of the snapshot's clock, which is the default
+    snapshot = Snapshot(path)
+    now = now or snapshot.now or datetime.now()
+    if users is None:
+        # snapshots that do not record which nodes are users fall back to every graph node
+        users = list(snapshot.users)
+    initargs = (path, n, now, recent_per_author, prune_factor)
+    start = time.perf_counter()
+    with open(output, "w", encoding = "utf-8") as file:
+        if vectorized:
+            results = vectorized_feeds(path, users, n, now, chunk_size)
+            pool = None
+        elif processes == 1:
+            _init_worker(*initargs)
+            results = map(_feed_chunk, chunked(users, chunk_size))
+            pool = None
+        else:
+            pool = Pool(processes, initializer = _init_worker, initargs = initargs)
+            results = pool.imap(_feed_chunk, chunked(users, chunk_size))
+        try:
+            for chunk in results:
+                for user, feed in chunk:
+                    file.write(json.dumps({"user": user, "feed": feed}) + "\n")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    return len(users), time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Precompute the feed of every user from an EdgeRank snapshot.")
+    parser.add_argument("--snapshot", default = "pickles/test/snapshot.bin")
+    parser.add_argument("--output", default = "feeds.jsonl")
+    parser.add_argument("--users", help = "file with one user name per line, every user recorded in the snapshot by default")
+    parser.add_argument("-n", "--top", type = int, default = 10)
+    parser.add_argument("--processes", type = int, help = "worker processes, one per cpu by default")
+    parser.add_argument("--chunk-size", type = int, default = 1000, help = "users handed to a worker at a time")
+    parser.add_argument("--as-of", type = datetime.fromisoformat, help = "rank the statuses as of this time instead of the snapshot's build time, "
+                                                                     "the edge weights keep the decays they were built with")
+    parser.add_argument("--recent-per-author", type = int)
+    parser.add_argument("--prune-factor", type = float, default = 1.0)
+    parser.add_argument("--vectorized", action = "store_true", help = "score exact feeds with numpy in one process, ignores --processes and the pruning options")
+    args = parser.parse_args()
+
+    users = None
+    if args.users:
+        with open(args.users, encoding = "utf-8") as file:
+            users = [line.strip() for line in file if line.strip()]
+    count, seconds = run_batch(args.snapshot, args.output, users, args.top, args.processes, args.chunk_size, args.as_of,
+                               args.recent_per_author, args.prune_factor, args.vectorized)
+    print(f"Wrote feeds for {count} users to {args.output} in {seconds:.2f}s ({count / max(seconds, 1e-9):.0f} users/s)")
@@ -0,0 +1,108 @@
+import numpy as np
+from entities.event_store import to_epoch
+from ranking import RankingContext
+from snapshot import STATUS_COUNTERS
+
+def status_weights(counters):
+    # the weight of main.calculate_status_weight before its decay, for every status at once
+    return (counters["comment_count"]*1.0 + counters["share_count"]*2.0 + counters["like_count"]*0.5 + counters["num_loves"]*1.0 + counters["num_wows"]*1.5
+            + counters["num_hahas"]*0.5 * counters["num_sads"]*0.25 + counters["num_angrys"]*0.25)
+
+def status_scores(counters, publish_times, context):
+    # the base score and edge decay FeedIndex and edgerank rank every status with, the edgerank of a status for a user
+    # with an edge of weight w to its author is base + w / decay
+    decays = context.edge_decays(publish_times)
+    return status_weights(counters) / context.status_decays(publish_times) / decays, decays
+
+class StatusColumns(object):
+    # the per-status terms FeedIndex ranks with, the base score and the edge decay, computed from the counter
+    # and publish time columns with array operations; counters maps every STATUS_COUNTERS name to a column
+    def __init__(self, ids, authors, counters, publish_times, context = None):
+        context = context or RankingContext()
+        self.ids = ids
+        authors, self.author_indexes = np.unique(np.array(authors, dtype = str), return_inverse = True)
+        self.authors = authors.tolist()
+        self.counters = counters
+        self.publish_times = np.asarray(publish_times, dtype = np.int64)
+        self.base_scores, self.decays = status_scores(counters, self.publish_times, context)
+        # statuses grouped by author, the statuses of author a are by_author[author_indptr[a]:author_indptr[a + 1]]
+        self.by_author = np.argsort(self.author_indexes, kind = "stable")
+        self.author_indptr = np.searchsorted(self.author_indexes[self.by_author], np.arange(len(self.authors) + 1))
+
+    @classmethod
+    def from_statuses(cls, statuses, context = None):
+        statuses = list(statuses)
+        counters = {column: np.array([getattr(status, column) for status in statuses], dtype = np.int64) for column in STATUS_COUNTERS}
+        return cls([status.id for status in statuses], [status.author for status in statuses], counters,
+                   [to_epoch(status.publish_time) for status in statuses], context)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, context = None):
+        # the counters and publish times are read straight from the snapshot's columns, no Status is built
+        context = context or RankingContext(snapshot.now)
+        counters = {column: snapshot.arrays[f"statuses.{column}"] for column in STATUS_COUNTERS}
+        return cls(list(snapshot.columns["id"]), list(snapshot.columns["author"]), counters, snapshot.arrays["statuses.publish_time"], context)
+
+    def __len__(self):
+        return len(self.ids)
+
+class AffinityMatrix(object):
+    # user x author edge weights in CSR form
+    def __init__(self, graph, users, authors):
+        self.users = list(users)
+        self.authors = list(authors)
+        author_index = {author: index for index, author in enumerate(self.authors)}
+        indptr = [0]
+        indices = []
+        data = []
+        for user in self.users:
+            if user in graph:
+                for author, edge in graph[user].items():
+                    if author in author_index:
+                        indices.append(author_index[author])
+                        data.append(edge['weight'])
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype = np.int64)
+        self.indices = np.array(indices, dtype = np.int64)
+        self.data = np.array(data, dtype = np.float64)
+
+def score_feeds(columns, affinities, n = 10, block_size = 256):
+    # the same scores as FeedIndex.exact_feed for a block of users per array operation: a user's candidates are the
+    # statuses of the authors they have an edge to, expanded through the author to status grouping, and the statuses
+    # with the n best base scores, which rank the same for every user without an edge to their author
+    n = min(n, len(columns))
+    popular = np.argsort(-columns.base_scores, kind = "stable")[:n]
+    popular_authors = columns.author_indexes[popular]
+    author_sizes = np.diff(columns.author_indptr)
+    for start in range(0, len(affinities.users), block_size):
+        stop = min(start + block_size, len(affinities.users))
+        begin, end = affinities.indptr[start], affinities.indptr[stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(affinities.indptr[start:stop + 1]))
+        authors, weights = affinities.indices[begin:end], affinities.data[begin:end]
+
+        # one entry per user and status of an author the user has an edge to
+        sizes = author_sizes[authors]
+        ends = np.cumsum(sizes)
+        statuses = columns.by_author[np.repeat(columns.author_indptr[authors] - ends + sizes, sizes) + np.arange(ends[-1] if len(ends) else 0)]
+        edge_rows = np.repeat(rows, sizes)
+        edge_scores = columns.base_scores[statuses] + np.repeat(weights, sizes) / columns.decays[statuses]
+
+        # popular statuses whose author the user has an edge to are already scored with that edge
+        edges = np.sort(rows * len(columns.authors) + authors)
+        keys = (np.arange(stop - start)[:, None] * len(columns.authors) + popular_authors).ravel()
+        positions = np.minimum(np.searchsorted(edges, keys), max(0, len(edges) - 1))
+        unscored = edges[positions] != keys if len(edges) else np.ones(len(keys), dtype = np.bool_)
+        popular_rows = np.repeat(np.arange(stop - start), len(popular))[unscored]
+        popular_statuses = np.tile(popular, stop - start)[unscored]
+
+        candidate_rows = np.concatenate([edge_rows, popular_rows])
+        candidates = np.concatenate([statuses, popular_statuses])
+        scores = np.concatenate([edge_scores, columns.base_scores[popular_statuses]])
+        # best score first within every user, ties go to the earlier status
+        order = np.lexsort((candidates, -scores, candidate_rows))
+        candidate_rows, candidates = candidate_rows[order], candidates[order]
+        ranks = np.arange(len(order)) - np.searchsorted(candidate_rows, np.arange(stop - start))[candidate_rows]
+        top_rows, top = candidate_rows[ranks < n], candidates[ranks < n]
+        bounds = np.searchsorted(top_rows, np.arange(stop - start + 1))
+        for row, user in enumerate(affinities.users[start:stop]):
+            yield user, [columns.ids[index] for index in top[bounds[row]:bounds[row + 1]]]
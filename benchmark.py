@@ -0,0 +1,263 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import numpy as np
+from tabulate import tabulate
+import main
+import parse_files
+from entities.event_store import Interner
+from entities.trie import Trie
+from entities.status import Status
+from entities.share import Share
+from graph_builder import build_graph, build_graph_external
+from batch_scoring import StatusColumns, AffinityMatrix, score_feeds
+from feed import FeedIndex
+from ingest import Ingestor
+from ranking import RankingContext
+
+# sizes of the generated dataset at scale 1, every count is multiplied by the scale factor
+SIZES = {"users": 2000, "friends": 10, "statuses": 5000, "comments": 10000, "shares": 10000, "reactions": 50000}
+REACTION_TYPES = ["likes", "loves", "wows", "hahas", "sads", "angrys", "special"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "ba", "de", "fi", "go", "hu", "ja", "pe", "tr", "um", "cl", "in"]
+FIRST_NAMES = ["Anna", "Brent", "Carla", "Dennis", "Elena", "Frank", "Gina", "Hugo", "Ivana", "Jack", "Katie", "Luka", "Marina", "Neil", "Olga", "Peter"]
+LAST_NAMES = ["Braun", "Cook", "Deva", "Fogh", "Haller", "Lowich", "Mayo", "Poulos", "Roberts", "Sands", "Signorelli", "Wells", "Zuber", "Weingard"]
+
+def generate_dataset(directory, scale = 1.0, seed = 0, test_fraction = 0.1):
+    # writes friends.csv and the original_/test_ status, comment, share and reaction files in the layout of dataset/
+    rng = random.Random(seed)
+    sizes = {name: max(1, int(size * scale)) for name, size in SIZES.items()}
+    sizes["friends"] = SIZES["friends"]
+    os.makedirs(directory, exist_ok = True)
+
+    users = []
+    seen = set()
+    while len(users) < sizes["users"]:
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        if name in seen:
+            name = f"{name} {len(users)}"
+        seen.add(name)
+        users.append(name)
+    # zipf-like word and author popularity, so a few words and users dominate like in the real data
+    vocabulary = sorted({"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(5000)})
+    word_weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    user_weights = [1 / (rank + 1) ** 0.8 for rank in range(len(users))]
+    now = datetime.now().replace(microsecond = 0)
+
+    def message(length):
+        return " ".join(rng.choices(vocabulary, word_weights, k = length)).capitalize()
+
+    def timestamp(after = None, days = 60):
+        start = after or now - timedelta(days = days)
+        return start + timedelta(seconds = rng.randint(0, max(1, int((now - start).total_seconds()))))
+
+    def split(prefix, header, rows):
+        cut = int(len(rows) * (1 - test_fraction))
+        for name, part in [("original", rows[:cut]), ("test", rows[cut:])]:
+            with open(os.path.join(directory, f"{name}_{prefix}.csv"), "w", encoding = "utf-8", newline = "") as file:
+                writer = csv.writer(file)
+                writer.writerow(header.split(","))
+                writer.writerows(part)
+
+    friends = {user: set() for user in users}
+    for user in users:
+        for friend in rng.sample(users, sizes["friends"] // 2):
+            if friend != user:
+                friends[user].add(friend)
+                friends[friend].add(user)
+    with open(os.path.join(directory, "friends.csv"), "w", encoding = "utf-8", newline = "") as file:
+        writer = csv.writer(file)
+        writer.writerow(["person", "number_of_friends", "friends"])
+        for user in users:
+            writer.writerow([user, len(friends[user])] + sorted(friends[user]))
+
+    statuses = []
+    rows = []
+    for index in range(sizes["statuses"]):
+        status_id, published = f"{rng.randint(10**14, 10**15 - 1)}_{100000 + index}", timestamp()
+        statuses.append((status_id, published))
+        rows.append([status_id, message(rng.randint(5, 30)), rng.choice(["link", "photo", "video", "status"]), f"http://example.com/{index}",
+                     published.strftime("%Y-%m-%d %H:%M:%S"), rng.choices(users, user_weights)[0]] + [rng.randint(0, 500) for _ in range(10)])
+    split("statuses", parse_files.get_statuses_header(), rows)
+
+    def events(count, row):
+        rows = []
+        for index in range(count):
+            status_id, published = rng.choice(statuses)
+            rows.append(row(index, status_id, timestamp(published).strftime("%Y-%m-%d %H:%M:%S"), rng.choices(users, user_weights)[0]))
+        return rows
+
+    split("comments", parse_files.get_comment_header(), events(sizes["comments"], lambda index, status_id, time, user:
+          [f"{status_id}_{index}", status_id, "", message(rng.randint(3, 15)), user, time] + [rng.randint(0, 20) for _ in range(8)]))
+    split("shares", parse_files.get_share_header(), events(sizes["shares"], lambda index, status_id, time, user: [status_id, user, time]))
+    split("reactions", parse_files.get_reaction_header(), events(sizes["reactions"], lambda index, status_id, time, user:
+          [status_id, rng.choice(REACTION_TYPES), user, time]))
+    return sizes
+
+def load_dataset(directory):
+    # fills main's module state the same way its __main__ block does
+    main.users, main.friends = main.load_users(os.path.join(directory, "friends.csv"))
+    main.interner = Interner()
+    for user in sorted(main.users):
+        main.interner.users.intern(user)
+    main.statuses.clear()
+    main.comments.clear()
+    main.shares = main.interner.share_store()
+    main.reactions = main.interner.reaction_store()
+    for prefix in ["original", "test"]:
+        for status in parse_files.stream_statuses(os.path.join(directory, f"{prefix}_statuses.csv")):
+            main.statuses[status.id] = status
+            main.interner.add_status(status)
+    for prefix in ["original", "test"]:
+        main.shares.extend(parse_files.stream_shares(os.path.join(directory, f"{prefix}_shares.csv")))
+        main.reactions.extend(parse_files.stream_reactions(os.path.join(directory, f"{prefix}_reactions.csv")))
+        for comment in parse_files.stream_comments(os.path.join(directory, f"{prefix}_comments.csv")):
+            if comment.author not in main.comments:
+                main.comments[comment.author] = [comment]
+            else:
+                main.comments[comment.author].append(comment)
+
+def load_legacy(directory):
+    for prefix in ["original", "test"]:
+        parse_files.load_statuses(os.path.join(directory, f"{prefix}_statuses.csv"))
+        parse_files.load_comments(os.path.join(directory, f"{prefix}_comments.csv"))
+        parse_files.load_shares(os.path.join(directory, f"{prefix}_shares.csv"))
+        parse_files.load_reactions(os.path.join(directory, f"{prefix}_reactions.csv"))
+
+class Benchmark(object):
+    def __init__(self, memory = False):
+        self.memory = memory
+        self.results = []
+
+    def run(self, name, function, operations = 1):
+        if self.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = function()
+        seconds = time.perf_counter() - start
+        result = {"stage": name, "seconds": seconds, "operations": operations, "seconds_per_operation": seconds / operations,
+                  "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+        if self.memory:
+            result["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results.append(result)
+        print(f"{name}: {seconds:.3f}s", file = sys.stderr)
+        return value
+
+def graphs_agree(graph, other):
+    # same nodes and edges, weights up to the float32 rounding of the differently ordered sums
+    return (list(graph.names) == list(other.names) and np.array_equal(graph.indptr, other.indptr) and np.array_equal(graph.indices, other.indices)
+            and np.allclose(graph.weights, other.weights, rtol = 1e-4) and np.array_equal(graph.friends, other.friends))
+
+def run_benchmarks(directory, queries = 200, memory = False, seed = 0, legacy = False, recent_per_author = None, prune_factor = 1.0):
+    rng = random.Random(seed)
+    benchmark = Benchmark(memory)
+    if legacy:
+        benchmark.run("load_legacy", lambda: load_legacy(directory))
+    benchmark.run("load", lambda: load_dataset(directory))
+    context = RankingContext()
+    graph = benchmark.run("create_graph", lambda: main.create_graph(context = context))
+    # the out-of-core build must find the same edges, also those of a user first seen in an event
+    shares = list(main.shares) + [Share(next(iter(main.statuses)), "Benchmark Outsider", context.now)]
+    compact = build_graph(main.users, main.friends, main.statuses, shares, main.reactions, main.comments, context = context)
+    # a small budget spreads the edges over several partitions
+    events = len(shares) + len(main.reactions) + sum(len(comments) for comments in main.comments.values())
+    external = benchmark.run("create_graph_external", lambda: build_graph_external(main.users, main.friends, main.statuses, shares, main.reactions,
+                                                                                   main.comments, 1024 * 1024, context = context, edge_estimate = events))
+    benchmark.results[-1]["agrees"] = graphs_agree(compact, external)
+    del shares, compact, external
+    # the affinities are added to graph in place, every later stage ranks with the augmented graph
+    benchmark.run("add_friend_affinities", lambda: main.add_friend_affinities(graph))
+    trie = benchmark.run("trie_build", lambda: Trie(main.statuses.values()))
+
+    # queries are drawn from the indexed text, so every search has hits
+    messages = [status.message.lower().split() for status in main.statuses.values()]
+    messages = [words for words in messages if len(words) >= 3]
+    users = rng.sample(sorted(main.users), min(queries, len(main.users)))
+    words = [" ".join(rng.sample(rng.choice(messages), 2)) for _ in range(queries)]
+    phrases = []
+    for _ in range(queries):
+        message = rng.choice(messages)
+        start = rng.randrange(len(message) - 1)
+        phrases.append(" ".join(message[start:start + 2]))
+    prefixes = [rng.choice(rng.choice(messages))[:2] for _ in range(queries)]
+
+    benchmark.run("search_query", lambda: [sorted(trie.search_query(query), key = lambda result: result[0] + main.edgerank(result[1], user, graph, context), reverse = True)
+                                           for user, query in zip(users * (queries // len(users) + 1), words)], queries)
+    benchmark.run("search_exact_query", lambda: [trie.search_exact_query(phrase) for phrase in phrases], queries)
+    benchmark.run("search_prefix", lambda: [trie.search_prefix(prefix) for prefix in prefixes], queries)
+    benchmark.run("autocomplete", lambda: [trie.autocomplete(prefix) for prefix in prefixes], queries)
+    benchmark.run("personal_autocomplete", lambda: [trie.personal_autocomplete(prefix, user, graph)
+                                                    for user, prefix in zip(users * (queries // len(users) + 1), prefixes)], queries)
+    feed_index = benchmark.run("feed_index", lambda: FeedIndex(graph, main.statuses, main.calculate_status_weight, context = context,
+                                                              recent_per_author = recent_per_author, prune_factor = prune_factor))
+    benchmark.run("feed", lambda: [feed_index.get_feed(user) for user in users], len(users))
+    benchmark.results[-1]["statuses_scored"] = feed_index.scored
+    benchmark.results[-1]["recall"] = feed_index.recall(users)
+    benchmark.run("feed_exact", lambda: [feed_index.exact_feed(user) for user in users], len(users))
+    columns = benchmark.run("status_columns", lambda: StatusColumns.from_statuses(main.statuses.values(), context))
+    vectorized = benchmark.run("feed_vectorized", lambda: dict(score_feeds(columns, AffinityMatrix(graph, users, columns.authors))), len(users))
+    # share of the exact feeds the vectorized scores agree with, ties can be broken differently
+    benchmark.results[-1]["recall"] = sum(len(set(feed_index.exact_feed(user)) & set(vectorized[user])) for user in users) / max(1, sum(len(vectorized[user]) for user in users))
+    benchmark.run("feed_sort", lambda: [sorted(main.statuses.values(), key = lambda status: main.edgerank(status, user, graph, context), reverse = True)[:10]
+                                        for user in users[:10]], min(10, len(users)))
+
+    # new statuses and shares of them go into the interned stores, a rebuild from that state must still find their authors
+    now = datetime.now()
+    events = []
+    for index, user in enumerate(users):
+        events.append(Status(f"ingested_{index}", "ingested status", "status", "", now, rng.choice(users), 0, 0, 0, 0, 0, 0, 0, 0, 0))
+        events.append(Share(f"ingested_{index}", user, now))
+    ingestor = Ingestor(graph, main.friends, main.statuses, main.shares, main.reactions, main.comments, trie, feed_index, interner = main.interner)
+    benchmark.run("ingest", lambda: ingestor.apply(events, context), len(events))
+    benchmark.run("create_graph_after_ingest", lambda: main.create_graph(context = context))
+    return benchmark.results
+
+def compare(previous, current):
+    # ratio above 1 means the current run is slower than the previous one
+    before = {result["stage"]: result for result in previous["results"]}
+    rows = []
+    for result in current["results"]:
+        old = before.get(result["stage"])
+        ratio = result["seconds_per_operation"] / old["seconds_per_operation"] if old and old["seconds_per_operation"] else None
+        rows.append([result["stage"], old["seconds"] if old else None, result["seconds"], ratio])
+    return tabulate(rows, headers = ["Stage", "Previous (s)", "Current (s)", "Ratio"], floatfmt = ".3f")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time and memory-profile the EdgeRank pipeline on a generated dataset.")
+    parser.add_argument("--directory", default = "benchmark_data", help = "where the synthetic dataset is written")
+    parser.add_argument("--scale", type = float, default = 1.0, help = "multiplies the number of users, statuses and events")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--memory", action = "store_true", help = "trace allocations for the peak of every stage, slows the stages down")
+    parser.add_argument("--legacy", action = "store_true", help = "also time the old parse_files.load_* readers")
+    parser.add_argument("--recent-per-author", type = int, help = "only score each author's newest statuses in feeds")
+    parser.add_argument("--prune-factor", type = float, default = 1.0, help = "skip feed authors whose score bound is below this times the k-th best score")
+    parser.add_argument("--reuse", action = "store_true", help = "keep an already generated dataset in the directory")
+    parser.add_argument("--output", help = "write the results as json to this file instead of stdout")
+    parser.add_argument("--compare", help = "json results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    sizes = None
+    if not (args.reuse and os.path.exists(os.path.join(args.directory, "friends.csv"))):
+        sizes = generate_dataset(args.directory, args.scale, args.seed)
+    report = {"config": {"scale": args.scale, "seed": args.seed, "queries": args.queries, "memory": args.memory, "sizes": sizes,
+                         "recent_per_author": args.recent_per_author, "prune_factor": args.prune_factor},
+              "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+              "time": datetime.now().isoformat(), "results": run_benchmarks(args.directory, args.queries, args.memory, args.seed, args.legacy,
+                                                                            args.recent_per_author, args.prune_factor)}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent = 2)
+    else:
+        print(json.dumps(report, indent = 2))
+    if args.compare:
+        with open(args.compare) as file:
+            print(compare(json.load(file), report), file = sys.stderr)
@@ -1,4 +1,6 @@
 class Comment(object):
+    __slots__ = ("id", "status_id", "parent_id", "message", "author", "publish_time", "reaction_count", "like_count")
+
     def __init__(self, id, status_id, parent_id, message, author, publish_time, reaction_count, like_count):
         self.id = id
         self.status_id = status_id
@@ -0,0 +1,95 @@
+from array import array
+from datetime import datetime, timedelta
+from entities.share import Share
+from entities.reaction import Reaction
+
+EPOCH = datetime(1970, 1, 1)
+REACTION_TYPES = ["likes", "loves", "wows", "hahas", "sads", "angrys", "special"]
+
+def to_epoch(time):
+    return (time - EPOCH) // timedelta(seconds = 1)
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds = seconds)
+
+class StringTable(object):
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, index):
+        return self.strings[index]
+
+    def intern(self, string):
+        index = self.indexes.get(string)
+        if index is None:
+            index = self.indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+class Interner(object):
+    # dense integer ids for users and statuses shared by the event stores and the graph build,
+    # with the author's user id of every status so events map to edges without touching strings
+    def __init__(self):
+        self.users = StringTable()
+        self.statuses = StringTable()
+        self.status_authors = array('i')
+
+    def add_status(self, status):
+        status_id = self.statuses.intern(status.id)
+        while len(self.status_authors) <= status_id:
+            self.status_authors.append(-1)
+        self.status_authors[status_id] = self.users.intern(status.author)
+        return status_id
+
+    def share_store(self):
+        return ShareStore(self.statuses, self.users)
+
+    def reaction_store(self):
+        return ReactionStore(self.statuses, self.users)
+
+class EventStore(object):
+    # struct of arrays: one typed column per field, strings replaced by indexes into shared tables
+    def __init__(self, status_ids = None, users = None):
+        self.status_ids = status_ids if status_ids is not None else StringTable()
+        self.users = users if users is not None else StringTable()
+        self.status_column = array('i')
+        self.user_column = array('i')
+        self.time_column = array('q')
+
+    def __len__(self):
+        return len(self.time_column)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def extend(self, events):
+        for event in events:
+            self.append(event)
+
+class ShareStore(EventStore):
+    def append(self, share):
+        self.status_column.append(self.status_ids.intern(share.status_id))
+        self.user_column.append(self.users.intern(share.sharer))
+        self.time_column.append(to_epoch(share.share_time))
+
+    def __getitem__(self, index):
+        return Share(self.status_ids[self.status_column[index]], self.users[self.user_column[index]], from_epoch(self.time_column[index]))
+
+class ReactionStore(EventStore):
+    def __init__(self, status_ids = None, users = None):
+        super().__init__(status_ids, users)
+        self.type_column = array('b')
+
+    def append(self, reaction):
+        self.status_column.append(self.status_ids.intern(reaction.status_id))
+        self.type_column.append(REACTION_TYPES.index(reaction.type))
+        self.user_column.append(self.users.intern(reaction.reactor))
+        self.time_column.append(to_epoch(reaction.reaction_time))
+
+    def __getitem__(self, index):
+        return Reaction(self.status_ids[self.status_column[index]], REACTION_TYPES[self.type_column[index]], self.users[self.user_column[index]], from_epoch(self.time_column[index]))
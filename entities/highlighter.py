@@ -0,0 +1,70 @@
+from collections import deque
+from colorama import Fore, Style
+
+def highlight_spans(spans, text):
+    parts = []
+    previous = 0
+    for start, end in spans:
+        parts.append(text[previous:start])
+        parts.append(f"{Fore.RED}{text[start:end]}{Style.RESET_ALL}")
+        previous = end
+    parts.append(text[previous:])
+    return "".join(parts)
+
+class Highlighter(object):
+    # Aho-Corasick automaton over the lowercased query words, so all words are found in one pass over the text
+    def __init__(self, words):
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [[]]
+        for word in set(words):
+            if word:
+                self.add_word(word)
+        self.link()
+
+    def add_word(self, word):
+        state = 0
+        for char in word:
+            if char not in self.transitions[state]:
+                self.transitions[state][char] = len(self.transitions)
+                self.transitions.append({})
+                self.failures.append(0)
+                self.outputs.append([])
+            state = self.transitions[state][char]
+        self.outputs[state].append(len(word))
+
+    def link(self):
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self.transitions[state].items():
+                queue.append(target)
+                failure = self.failures[state]
+                while failure and char not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[target] = self.transitions[failure].get(char, 0)
+                self.outputs[target] = self.outputs[target] + self.outputs[self.failures[target]]
+
+    def spans(self, text):
+        # matches are found on the lowercased characters but reported as offsets into the original text
+        starts = []
+        state = 0
+        for index, char in enumerate(text):
+            for lower in char.lower():
+                while state and lower not in self.transitions[state]:
+                    state = self.failures[state]
+                state = self.transitions[state].get(lower, 0)
+                for length in self.outputs[state]:
+                    starts.append((index, length))
+
+        spans = []
+        for index, length in starts:
+            start, end = max(0, index + 1 - length), index + 1
+            while spans and start <= spans[-1][1]:
+                previous_start, previous_end = spans.pop()
+                start, end = min(start, previous_start), max(end, previous_end)
+            spans.append((start, end))
+        return spans
+
+    def highlight(self, text):
+        return highlight_spans(self.spans(text), text)
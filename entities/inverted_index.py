@@ -0,0 +1,190 @@
+import math
+from array import array
+
+def encode_varint(value, buffer):
+    while value >= 0x80:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def read_varint(buffer, position):
+    value = shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+def decode_varints(buffer):
+    value = shift = 0
+    for byte in buffer:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield value
+        value = shift = 0
+
+def decode_postings(buffer):
+    # postings are (doc id gap, term frequency) varint pairs, doc ids are rebuilt from the gaps
+    values = decode_varints(buffer)
+    doc_id = 0
+    for gap in values:
+        doc_id += gap
+        yield doc_id, next(values)
+
+def encode_postings(postings):
+    buffer = bytearray()
+    previous = 0
+    for doc_id, frequency in postings:
+        encode_varint(doc_id - previous, buffer)
+        encode_varint(frequency, buffer)
+        previous = doc_id
+    return buffer
+
+def encode_positions(hits, buffer):
+    # every hit is a (token position, start offset, end offset) triple, stored as gaps from the previous hit and a length
+    previous_position = previous_start = 0
+    for position, start, end in hits:
+        encode_varint(position - previous_position, buffer)
+        encode_varint(start - previous_start, buffer)
+        encode_varint(end - start, buffer)
+        previous_position, previous_start = position, start
+
+def decode_positions(buffer, frequencies):
+    values = decode_varints(buffer)
+    for frequency in frequencies:
+        hits = []
+        position = start = 0
+        for _ in range(frequency):
+            position += next(values)
+            start += next(values)
+            hits.append((position, start, start + next(values)))
+        yield hits
+
+class InvertedIndex(object):
+    def __init__(self, k1 = 1.2, b = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = {}
+        self.postings = []
+        self.positions = []
+        self.last_documents = array('i')
+        self.document_frequencies = array('i')
+        self.documents = []
+        self.document_lengths = array('i')
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add_document(self, document, tokens):
+        # tokens are (word, start, end) for every whitespace separated token of the text, empty words keep their position
+        doc_id = len(self.documents)
+        self.documents.append(document)
+        occurrences = {}
+        for position, (word, start, end) in enumerate(tokens):
+            if word:
+                if word not in occurrences:
+                    occurrences[word] = [(position, start, end)]
+                else:
+                    occurrences[word].append((position, start, end))
+        length = sum(len(hits) for hits in occurrences.values())
+        self.document_lengths.append(length)
+        self.total_length += length
+
+        for word, hits in occurrences.items():
+            term_id = self.term_id(word)
+            encode_varint(doc_id - self.last_documents[term_id], self.postings[term_id])
+            encode_varint(len(hits), self.postings[term_id])
+            encode_positions(hits, self.positions[term_id])
+            self.last_documents[term_id] = doc_id
+            self.document_frequencies[term_id] += 1
+        return occurrences
+
+    def term_id(self, word):
+        term_id = self.terms.get(word)
+        if term_id is None:
+            term_id = self.terms[word] = len(self.postings)
+            self.postings.append(bytearray())
+            self.positions.append(bytearray())
+            self.last_documents.append(0)
+            self.document_frequencies.append(0)
+        return term_id
+
+    def merge(self, shard):
+        # appends an index built over the documents that follow this one; only the first doc id gap
+        # of every shard posting list has to be re-encoded, the rest of the bytes are copied as they are
+        offset = len(self.documents)
+        self.documents.extend(shard.documents)
+        self.document_lengths.extend(shard.document_lengths)
+        self.total_length += shard.total_length
+        for word, shard_term_id in shard.terms.items():
+            term_id = self.term_id(word)
+            postings = shard.postings[shard_term_id]
+            first_doc_id, position = read_varint(postings, 0)
+            encode_varint(offset + first_doc_id - self.last_documents[term_id], self.postings[term_id])
+            self.postings[term_id] += postings[position:]
+            self.positions[term_id] += shard.positions[shard_term_id]
+            self.last_documents[term_id] = offset + shard.last_documents[shard_term_id]
+            self.document_frequencies[term_id] += shard.document_frequencies[shard_term_id]
+
+    def postings_list(self, word):
+        term_id = self.terms.get(word)
+        if term_id is None:
+            return []
+        return list(decode_postings(self.postings[term_id]))
+
+    def positions_list(self, word):
+        term_id = self.terms.get(word)
+        if term_id is None:
+            return {}
+        postings = self.postings_list(word)
+        return dict(zip((doc_id for doc_id, _ in postings), decode_positions(self.positions[term_id], (frequency for _, frequency in postings))))
+
+    def phrase(self, words):
+        # words are (offset in the phrase, word) pairs; returns the character span of every match per document
+        if not words:
+            return {}
+        words = sorted(words, key = lambda word: self.document_frequencies[self.terms[word[1]]] if word[1] in self.terms else -1)
+        hits = []
+        documents = None
+        for offset, word in words:
+            word_hits = self.positions_list(word)
+            documents = set(word_hits) if documents is None else documents & word_hits.keys()
+            if not documents:
+                return {}
+            hits.append((offset, word_hits))
+
+        first_offset = min(offset for offset, _ in words)
+        last_offset = max(offset for offset, _ in words)
+        results = {}
+        for doc_id in documents:
+            spans = {}
+            for offset, word_hits in hits:
+                spans[offset] = {position - offset: (start, end) for position, start, end in word_hits[doc_id]}
+            anchors = set.intersection(*(set(offset_spans) for offset_spans in spans.values()))
+            if anchors:
+                results[doc_id] = [(spans[first_offset][anchor][0], spans[last_offset][anchor][1]) for anchor in sorted(anchors)]
+        return results
+
+    def idf(self, word):
+        term_id = self.terms.get(word)
+        frequency = 0 if term_id is None else self.document_frequencies[term_id]
+        return math.log(1 + (len(self) - frequency + 0.5) / (frequency + 0.5))
+
+    def bm25_term(self, word):
+        idf = self.idf(word)
+        average_length = self.total_length / max(1, len(self))
+        for doc_id, frequency in self.postings_list(word):
+            normalization = self.k1 * (1 - self.b + self.b * self.document_lengths[doc_id] / average_length)
+            yield doc_id, idf * frequency * (self.k1 + 1) / (frequency + normalization)
+
+    def bm25(self, words):
+        scores = {}
+        for word in words:
+            for doc_id, score in self.bm25_term(word):
+                scores[doc_id] = scores.get(doc_id, 0) + score
+        return scores
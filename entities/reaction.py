@@ -1,4 +1,6 @@
 class Reaction(object):
+    __slots__ = ("status_id", "type", "reactor", "reaction_time")
+
     def __init__(self, status_id, reaction_type, reactor, reaction_time):
         self.status_id = status_id
         self.type = reaction_type
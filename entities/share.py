@@ -1,4 +1,6 @@
 class Share(object):
+    __slots__ = ("status_id", "sharer", "share_time")
+
     def __init__(self, status_id, sharer, share_time):
         self.status_id = status_id
         self.sharer = sharer
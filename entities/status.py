@@ -1,4 +1,6 @@
 class Status(object):
+    __slots__ = ("id", "message", "type", "link", "publish_time", "author", "reaction_count", "comment_count", "share_count", "like_count", "num_loves", "num_wows", "num_hahas", "num_sads", "num_angrys")
+
     def __init__(self, id, message, status_type, link, publish_time, author, reaction_count, comment_count, share_count, like_count, num_loves, num_wows, num_hahas, num_sads, num_angrys):
         self.id = id
         self.message = message
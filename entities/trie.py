@@ -1,97 +1,249 @@
-import copy
-from colorama import Fore, Style
+import re
+from bisect import bisect_left
 import string
+from multiprocessing import Pool
+from entities.comment import Comment
+from entities.inverted_index import InvertedIndex
+
+STRIP_TABLE = str.maketrans('', '', string.punctuation + '“”‘’:')
+TOKEN_PATTERN = re.compile(r"\S+")
+
+def strip_word(word):
+    return word.strip().translate(STRIP_TABLE)
+
+def tokenize(text):
+    return [(strip_word(match.group()).lower(), match.start(), match.end()) for match in TOKEN_PATTERN.finditer(text)]
+
+def build_shard(texts):
+    index = InvertedIndex()
+    for text in texts:
+        index.add_document(None, tokenize(text))
+    return index
 
 class TrieNode(object):
+    # children are kept as a string of edge characters and a parallel list instead of a dict per node
+    __slots__ = ("keys", "children", "is_end_of_word", "completions")
+
     def __init__(self):
-        self.children = {}
+        self.keys = ""
+        self.children = []
         self.is_end_of_word = False
-        self.statuses = {}
+        self.completions = ()
+
+    def child(self, char):
+        index = self.keys.find(char)
+        return self.children[index] if index >= 0 else None
+
+    def add_child(self, char):
+        node = TrieNode()
+        self.keys += char
+        self.children.append(node)
+        return node
 
 class Trie(object):
-    def __init__(self, statuses):
+    def __init__(self, statuses, completion_size = 10, comments = None, processes = None, shard_size = 5000):
         self.root = TrieNode()
+        self.index = InvertedIndex()
+        self.completion_size = completion_size
+        self.statuses = {}
+        self.index_comments = comments is not None
+        # documents per word of every status author, comments count towards the author of their status;
+        # each author's words are sorted on demand for prefix ranges
+        self.author_words = {}
+        self.author_vocabularies = {}
 
-        for status in statuses:
-            for word in status.message.split():
-                self.insert_word(self.strip_word(word).lower(), status)
+        # comments are indexed as documents of their own and count towards the status they belong to
+        documents = list(statuses)
+        for status in documents:
+            self.statuses[status.id] = status
+        if comments is not None:
+            documents.extend(comment for group in comments.values() for comment in group if comment.status_id in self.statuses)
+
+        if processes:
+            texts = [document.message for document in documents]
+            with Pool(processes) as pool:
+                for shard in pool.imap(build_shard, [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]):
+                    self.index.merge(shard)
+            self.index.documents = documents
+            for word in self.index.terms:
+                self.insert_word(word)
+                for doc_id, _ in self.index.postings_list(word):
+                    status = self.status_of(documents[doc_id])
+                    if status is not None:
+                        self.add_author_words(status.author, [word])
+        else:
+            for document in documents:
+                self.insert_document(document, False)
+        self.build_completions()
 
+    def insert_document(self, document, update_completions = True):
+        words = self.index.add_document(document, tokenize(document.message))
+        status = self.status_of(document)
+        if status is not None:
+            self.add_author_words(status.author, words)
+        for word in words:
+            path = self.insert_word(word)
+            if update_completions:
+                self.update_completions(path, word)
 
-    def insert_word(self, word, status):
+    def add_author_words(self, author, words):
+        counts = self.author_words.get(author)
+        if counts is None:
+            counts = self.author_words[author] = {}
+        for word in words:
+            if word not in counts:
+                counts[word] = 1
+                self.author_vocabularies[author] = None
+            else:
+                counts[word] += 1
+
+    def author_vocabulary(self, author):
+        words = self.author_vocabularies.get(author)
+        if words is None:
+            words = self.author_vocabularies[author] = sorted(self.author_words[author])
+        return words
+
+    def insert_status(self, status, update_completions = True):
+        self.statuses[status.id] = status
+        self.insert_document(status, update_completions)
+
+    def status_of(self, document):
+        return self.statuses.get(document.status_id) if isinstance(document, Comment) else document
+
+    def insert_word(self, word):
         node = self.root
+        path = [node]
         for char in word:
-            if char not in node.children:
-                node.children[char] = TrieNode()
-            node = node.children[char]
-        if status.id not in node.statuses:
-            node.statuses[status.id] = [1, status]
-        else:
-            node.statuses[status.id][0] += 1 # number of appearances
+            child = node.child(char)
+            node = child if child is not None else node.add_child(char)
+            path.append(node)
         node.is_end_of_word = True
+        return path
 
-    def search_word(self, word):
+    def find_node(self, prefix):
         node = self.root
-        for char in word:
-            if char not in node.children:
-                return {}
-            node = node.children[char]
-        return node.statuses if node.is_end_of_word else {}
+        for char in prefix:
+            node = node.child(char)
+            if node is None:
+                return None
+        return node
+
+    def document_frequency(self, word):
+        return self.index.document_frequencies[self.index.terms[word]]
+
+    def rank_completions(self, completions):
+        return tuple(sorted(completions, key = lambda completion: (-completion[0], completion[1]))[:self.completion_size])
+
+    def build_completions(self):
+        # post-order walk, every node keeps the best completions out of its own word and its children's lists
+        stack = [(self.root, "", False)]
+        while stack:
+            node, prefix, visited = stack.pop()
+            if not visited:
+                stack.append((node, prefix, True))
+                stack.extend((child, prefix + char, False) for char, child in zip(node.keys, node.children))
+                continue
+            completions = [completion for child in node.children for completion in child.completions]
+            if node.is_end_of_word:
+                completions.append((self.document_frequency(prefix), prefix))
+            node.completions = self.rank_completions(completions)
+
+    def update_completions(self, path, word):
+        completion = (self.document_frequency(word), word)
+        # document frequencies only grow, so once the word misses a node's list it misses every ancestor's too
+        for node in reversed(path):
+            completions = [existing for existing in node.completions if existing[1] != word]
+            if len(completions) == len(node.completions) and len(completions) >= self.completion_size and (-completions[-1][0], completions[-1][1]) < (-completion[0], word):
+                break
+            node.completions = self.rank_completions(completions + [completion])
+
+    def search_word(self, word):
+        results = {}
+        for doc_id, frequency in self.index.postings_list(word):
+            status = self.status_of(self.index.documents[doc_id])
+            if status is not None:
+                if status.id not in results:
+                    results[status.id] = [frequency, status]
+                else:
+                    results[status.id][0] += frequency
+        return results
     
     def strip_word(self, word):
-        word = word.strip()
-        additional_chars = string.punctuation + '“”‘’:'
-        word = word.translate(str.maketrans('', '', additional_chars))
-        word = word.replace("'", "").replace('"', '')
-        return word
+        return strip_word(word)
     
+    def query_words(self, query):
+        return [word for word in (self.strip_word(word).lower() for word in query.split()) if word]
+
     def search_query(self, query):
         results = {}
-        for idx, word in enumerate(query.split(), start = 1):
-            word = self.strip_word(word).lower()
-            if word:
-                filtered_statuses = self.search_word(word)
-                for status_id in filtered_statuses:
-                    if status_id not in results:
-                        results[status_id] = copy.deepcopy(filtered_statuses[status_id])
-                    else:
-                        results[status_id][0] += filtered_statuses[status_id][0]
-                        if idx == len(query.split()):
-                            results[status_id][0] += 10
-                    
-                    results[status_id][1].message = self.highlight_text(word, results[status_id][1].message)
+        for word in self.query_words(query):
+            for doc_id, score in self.index.bm25_term(word):
+                status = self.status_of(self.index.documents[doc_id])
+                if status is None:
+                    continue
+                if status.id not in results:
+                    results[status.id] = [score, status]
+                else:
+                    results[status.id][0] += score
         return results.values()
-    
+
     def search_exact_query(self, query):
-        results = []
-        filtered_statuses = self.search_word(self.strip_word(query.split()[0]))
-        for status_id in filtered_statuses:
-            if query in ' '.join(self.strip_word(word).lower() for word in filtered_statuses[status_id][1].message.split()):
-                status = copy.deepcopy(filtered_statuses[status_id][1])
-                status.message = self.highlight_text(query, status.message)
-                results.append(status)
-        return results
-    
+        # each result carries the character spans of its matches for highlighting at render time
+        words = [(offset, self.strip_word(word).lower()) for offset, word in enumerate(query.split())]
+        results = {}
+        for doc_id, spans in self.index.phrase([(offset, word) for offset, word in words if word]).items():
+            document = self.index.documents[doc_id]
+            status = self.status_of(document)
+            if status is None:
+                continue
+            if status.id not in results:
+                results[status.id] = [[], status]
+            # spans of a matching comment point into the comment, so only the status' own spans are kept
+            if document is status:
+                results[status.id][0] = spans
+        return list(results.values())
+
     def search_prefix(self, prefix):
-        node = self.root
-        for char in prefix:
-            if char not in node.children:
-                return []
-            node = node.children[char]
+        node = self.find_node(prefix)
+        if node is None:
+            return []
         return self.get_words_from_prefix(node, prefix)
 
     def get_words_from_prefix(self, node, prefix):
         words = []
         if node.is_end_of_word:
             words.append(prefix)
-        for char, child in node.children.items():
+        for char, child in zip(node.keys, node.children):
             words.extend(self.get_words_from_prefix(child, prefix + char))
         return words
-    
-    def highlight_text(self, word, text):
-        indexes = [i for i in range(len(text)) if text.lower().startswith(word, i)]
-        offset = 0
-        for index in indexes:
-            index += offset
-            text = f"{text[:index]}{Fore.RED}{text[index:index+len(word)]}{Style.RESET_ALL}{text[index+len(word):]}"
-            offset += len(Fore.RED) + len(Style.RESET_ALL)
-        return text
+
+    def autocomplete(self, prefix, key = None):
+        # ranked by document frequency, key can re-rank the precomputed completions (e.g. by the user's affinity)
+        node = self.find_node(prefix)
+        if node is None:
+            return []
+        words = [word for _, word in node.completions]
+        if key is not None:
+            words.sort(key = key, reverse = True)
+        return words
+
+    def personal_autocomplete(self, prefix, user, graph):
+        # a word's affinity is the weight of the user's edge to an author times the author's documents with the word,
+        # summed over the authors the user has an edge to; their words under the prefix are found in each author's sorted
+        # words, the node's completions cover the words none of them use, and ties are ranked like rank_completions
+        node = self.find_node(prefix)
+        if node is None:
+            return []
+        affinities = {}
+        for author, edge in (graph[user].items() if user in graph else ()):
+            counts = self.author_words.get(author)
+            if counts is None:
+                continue
+            words = self.author_vocabulary(author)
+            for position in range(bisect_left(words, prefix), len(words)):
+                word = words[position]
+                if not word.startswith(prefix):
+                    break
+                affinities[word] = affinities.get(word, 0) + edge['weight'] * counts[word]
+        candidates = {word for _, word in node.completions} | affinities.keys()
+        return sorted(candidates, key = lambda word: (-affinities.get(word, 0), -self.document_frequency(word), word))[:self.completion_size]
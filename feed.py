@@ -0,0 +1,134 @@
+import heapq
+from ranking import RankingContext
+
+class FeedIndex(object):
+    # recent_per_author and prune_factor trade recall for speed, the defaults keep feeds exact:
+    # recent_per_author limits candidates to each author's newest statuses, and authors are skipped
+    # once their score bound falls below prune_factor times the current k-th best score
+    def __init__(self, graph, statuses, weight_function, k = 10, cache = None, context = None, recent_per_author = None, prune_factor = 1.0):
+        self.graph = graph
+        self.statuses = statuses
+        self.weight_function = weight_function
+        self.k = k
+        self.recent_per_author = recent_per_author
+        self.prune_factor = prune_factor
+        # optional ResultCache holding feeds served further up, dropped together with the feeds here
+        self.cache = cache
+        self.scored = 0
+        self.refresh(context)
+
+    def refresh(self, context = None):
+        # ranks every status as of the context's clock, re-ranking as of another time is a refresh with its context
+        self.context = context or RankingContext()
+        self.base_scores = {}
+        self.decays = {}
+        self.authors = {}
+        self.author_statuses = {}
+        for status in self.statuses.values():
+            decay = self.context.status_edge_decay(status)
+            self.decays[status.id] = decay
+            self.authors[status.id] = status.author
+            self.base_scores[status.id] = self.weight_function(status, self.context) / decay
+            if status.author not in self.author_statuses:
+                self.author_statuses[status.author] = [status.id]
+            else:
+                self.author_statuses[status.author].append(status.id)
+        self.author_bounds = {}
+        for author in self.author_statuses:
+            self.refresh_author(author)
+        # statuses whose authors have no edge to the user are ranked only by their base score,
+        # so the global top k by base score is enough to cover them
+        self.popular = heapq.nlargest(self.k, self.base_scores, key = self.base_scores.get)
+        self.invalidate()
+
+    def refresh_author(self, author):
+        # newest statuses first, and the largest base score and inverse decay among them, which bound
+        # the score of any of the author's statuses for a user with an edge of weight w as base + w * inverse decay
+        statuses = self.author_statuses[author]
+        statuses.sort(key = self.context.status_ages.__getitem__)
+        self.author_bounds[author] = (max(self.base_scores[status_id] for status_id in statuses),
+                                      1 / min(self.decays[status_id] for status_id in statuses))
+
+    def update_status(self, status):
+        if status.id not in self.base_scores:
+            self.authors[status.id] = status.author
+            if status.author not in self.author_statuses:
+                self.author_statuses[status.author] = [status.id]
+            else:
+                self.author_statuses[status.author].append(status.id)
+        decay = self.context.status_edge_decay(status)
+        self.decays[status.id] = decay
+        self.base_scores[status.id] = self.weight_function(status, self.context) / decay
+        self.refresh_author(status.author)
+
+        if status.id in self.popular or len(self.popular) < self.k or self.base_scores[status.id] > self.base_scores[self.popular[-1]]:
+            self.popular = heapq.nlargest(self.k, self.base_scores, key = self.base_scores.get)
+            self.invalidate()
+        elif status.author in self.graph:
+            self.invalidate(self.graph.predecessors(status.author))
+
+    def invalidate(self, users = None):
+        if users is None:
+            self.feeds = {}
+        else:
+            users = list(users)
+            for user in users:
+                self.feeds.pop(user, None)
+        if self.cache is not None:
+            self.cache.invalidate(users, ("feed",))
+
+    def build_feed(self, user):
+        edges = self.graph[user] if user in self.graph else {}
+        candidates = {}
+        for status_id in self.popular:
+            edge = edges.get(self.authors[status_id]) if edges else None
+            candidates[status_id] = self.base_scores[status_id] + (edge['weight'] / self.decays[status_id] if edge is not None else 0)
+        top = heapq.nsmallest(self.k, candidates.values())
+
+        # authors are visited from the highest score bound down, once a bound cannot beat the k-th best score
+        # neither can any later author's statuses; authors already below the popular statuses are never sorted
+        threshold = top[0] * self.prune_factor if len(top) == self.k else float("-inf")
+        authors = []
+        for author, edge in edges.items():
+            bounds = self.author_bounds.get(author)
+            if bounds is not None:
+                bound = bounds[0] + edge['weight'] * bounds[1]
+                if bound >= threshold:
+                    authors.append((bound, author, edge['weight']))
+        authors.sort(reverse = True)
+        for bound, author, weight in authors:
+            if len(top) == self.k and bound < top[0] * self.prune_factor:
+                break
+            for status_id in self.author_statuses[author][:self.recent_per_author]:
+                if status_id in candidates:
+                    continue
+                score = candidates[status_id] = self.base_scores[status_id] + weight / self.decays[status_id]
+                self.scored += 1
+                if len(top) < self.k:
+                    heapq.heappush(top, score)
+                elif score > top[0]:
+                    heapq.heapreplace(top, score)
+        return heapq.nlargest(self.k, candidates, key = candidates.get)
+
+    def exact_feed(self, user):
+        # every status of every author the user has an edge to, without pruning
+        candidates = {status_id: self.base_scores[status_id] for status_id in self.popular}
+        if user in self.graph:
+            for author, edge in self.graph[user].items():
+                for status_id in self.author_statuses.get(author, ()):
+                    candidates[status_id] = self.base_scores[status_id] + edge['weight'] / self.decays[status_id]
+        return heapq.nlargest(self.k, candidates, key = candidates.get)
+
+    def recall(self, users):
+        # share of the exact top k that the configured candidate generation finds, averaged over the users
+        found = expected = 0
+        for user in users:
+            exact = self.exact_feed(user)
+            found += len(set(exact) & set(self.build_feed(user)))
+            expected += len(exact)
+        return found / max(1, expected)
+
+    def get_feed(self, user):
+        if user not in self.feeds:
+            self.feeds[user] = self.build_feed(user)
+        return [self.statuses[status_id] for status_id in self.feeds[user]]
@@ -0,0 +1,305 @@
+import os
+import tempfile
+from array import array
+import numpy as np
+from multiprocessing import Pool
+from ranking import RankingContext
+from entities.event_store import REACTION_TYPES, EventStore, ShareStore
+
+REACTION_WEIGHTS = {"likes": 0.5, "loves": 1.0, "wows": 1.5, "hahas": 0.5, "sads": 0.25, "angrys": 0.75, "special": 0}
+FRIEND_WEIGHT = 3.0
+REACTION_TYPE_WEIGHTS = np.array([REACTION_WEIGHTS[reaction_type] for reaction_type in REACTION_TYPES])
+EDGE_RECORD = np.dtype([("key", np.int64), ("weight", np.float64)])
+
+class CompactGraph(object):
+    def __init__(self, names, indptr, indices, weights, friends, user_ids = None):
+        self.names = names
+        self.user_ids = user_ids if user_ids is not None else {name: index for index, name in enumerate(names)}
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.friends = friends
+
+    def __contains__(self, user):
+        return user in self.user_ids
+
+    # read-only view with the same shape as a networkx adjacency, so feed code can take either graph
+    def __getitem__(self, user):
+        user_id = self.user_ids[user]
+        start, end = self.indptr[user_id], self.indptr[user_id + 1]
+        return {self.names[index]: {'weight': float(weight), 'friends': bool(friends)}
+                for index, weight, friends in zip(self.indices[start:end], self.weights[start:end], self.friends[start:end])}
+
+    def successors(self, user):
+        user_id = self.user_ids[user]
+        start, end = self.indptr[user_id], self.indptr[user_id + 1]
+        return [(self.names[index], float(weight)) for index, weight in zip(self.indices[start:end], self.weights[start:end])]
+
+    def get_edge_data(self, user1, user2):
+        if user1 not in self.user_ids or user2 not in self.user_ids:
+            return None
+        user_id, target = self.user_ids[user1], self.user_ids[user2]
+        start, end = self.indptr[user_id], self.indptr[user_id + 1]
+        position = start + np.searchsorted(self.indices[start:end], target)
+        if position < end and self.indices[position] == target:
+            return {'weight': float(self.weights[position]), 'friends': bool(self.friends[position])}
+        return None
+
+    def edge_weight(self, user1, user2):
+        user_id = self.user_ids[user1]
+        start, end = self.indptr[user_id], self.indptr[user_id + 1]
+        position = start + np.searchsorted(self.indices[start:end], self.user_ids[user2])
+        if position < end and self.indices[position] == self.user_ids[user2]:
+            return float(self.weights[position])
+        return None
+
+    def to_networkx(self):
+        # networkx is only imported by callers that ask for a networkx graph
+        import networkx as nx
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.names)
+        sources = np.repeat(np.arange(len(self.names)), np.diff(self.indptr))
+        graph.add_edges_from((self.names[source], self.names[target], {'weight': float(weight), 'friends': bool(friends)})
+                             for source, target, weight, friends in zip(sources, self.indices, self.weights, self.friends))
+        return graph
+
+def from_networkx(graph):
+    names = list(graph.nodes)
+    user_ids = {name: index for index, name in enumerate(names)}
+    indptr = [0]
+    indices = []
+    weights = []
+    friends = []
+    for name in names:
+        for target, edge in sorted(graph[name].items(), key = lambda item: user_ids[item[0]]):
+            indices.append(user_ids[target])
+            weights.append(edge['weight'])
+            friends.append(edge.get('friends', False))
+        indptr.append(len(indices))
+    return CompactGraph(names, np.array(indptr, dtype = np.int64), np.array(indices, dtype = np.int32),
+                        np.array(weights, dtype = np.float32), np.array(friends, dtype = np.bool_), user_ids)
+
+def iter_entities(events):
+    # events are either grouped per user in a dict of lists or kept in an EventStore
+    if isinstance(events, dict):
+        for group in events.values():
+            yield from group
+    else:
+        yield from events
+
+def iter_events(shares, reactions, comments):
+    for share in iter_entities(shares):
+        yield share.sharer, share.status_id, 2.0, share.share_time
+    for reaction in iter_entities(reactions):
+        yield reaction.reactor, reaction.status_id, REACTION_WEIGHTS[reaction.type], reaction.reaction_time
+    for comment in iter_entities(comments):
+        yield comment.author, comment.status_id, 1.0, comment.publish_time
+
+def reduce_edges(keys, weights):
+    keys, inverse = np.unique(keys, return_inverse = True)
+    return keys, np.bincount(inverse.ravel(), weights = weights, minlength = len(keys))
+
+def accumulate_events(events, status_authors, context):
+    keys = []
+    weights = []
+    for user_id, status_id, weight, time in events:
+        keys.append(user_id << 32 | status_authors[status_id])
+        weights.append(weight / context.edge_decay(time))
+    return reduce_edges(np.array(keys, dtype = np.int64), np.array(weights, dtype = np.float64))
+
+def accumulate_store(store, status_authors, context):
+    # vectorised accumulate_events over the integer columns of a share or reaction store interned with the graph's ids
+    if isinstance(store, ShareStore):
+        weights = np.full(len(store), 2.0)
+    else:
+        weights = REACTION_TYPE_WEIGHTS[np.frombuffer(store.type_column, dtype = np.int8)]
+    # statuses interned after the last add_status are past the end of status_authors or padded with -1
+    status_ids = np.frombuffer(store.status_column, dtype = np.int32)
+    known = status_ids < len(status_authors)
+    authors = np.full(len(status_ids), -1, dtype = np.int64)
+    authors[known] = status_authors[status_ids[known]]
+    if len(authors) and authors.min() < 0:
+        raise KeyError(f"Event for status {store.status_ids[status_ids[np.argmax(authors < 0)]]} that was never added to the interner")
+    keys = np.frombuffer(store.user_column, dtype = np.int32).astype(np.int64) << 32 | authors
+    return reduce_edges(keys, weights / context.edge_decays(np.frombuffer(store.time_column, dtype = np.int64)))
+
+_worker_status_authors = None
+_worker_context = None
+
+def _init_worker(status_authors, context):
+    global _worker_status_authors, _worker_context
+    _worker_status_authors = status_authors
+    _worker_context = context
+
+def _accumulate_chunk(events):
+    return accumulate_events(events, _worker_status_authors, _worker_context)
+
+def index_users(users, friends, statuses, interner = None):
+    # dense user ids, the author id of every status and the sorted keys of both directions of every friendship;
+    # with an interner its ids are used, so they agree with event stores interned against the same tables
+    if interner is not None:
+        names, user_ids, intern = interner.users.strings, interner.users.indexes, interner.users.intern
+        for name in sorted(users):
+            intern(name)
+    else:
+        names = sorted(users)
+        user_ids = {name: index for index, name in enumerate(names)}
+
+        def intern(name):
+            if name not in user_ids:
+                user_ids[name] = len(names)
+                names.append(name)
+            return user_ids[name]
+
+    status_authors = {status.id: intern(status.author) for status in statuses.values()}
+
+    # a typed array holds a key in 8 bytes where a list of ints takes about 40
+    friend_keys = array('q')
+    for user in friends:
+        for friend in friends[user]:
+            friend_keys.append(intern(user) << 32 | intern(friend))
+            friend_keys.append(intern(friend) << 32 | intern(user))
+    return names, user_ids, intern, status_authors, np.unique(np.frombuffer(friend_keys, dtype = np.int64))
+
+def friend_flags(keys, friend_keys):
+    # both arrays are sorted, a binary search needs less temporary memory than np.isin
+    positions = np.minimum(np.searchsorted(friend_keys, keys), max(0, len(friend_keys) - 1))
+    return friend_keys[positions] == keys if len(friend_keys) else np.zeros(len(keys), dtype = np.bool_)
+
+def compact_graph(names, keys, weights, friends, user_ids = None):
+    indptr = np.zeros(len(names) + 1, dtype = np.int64)
+    np.cumsum(np.bincount(keys >> 32, minlength = len(names)), out = indptr[1:])
+    return CompactGraph(names, indptr, (keys & 0xffffffff).astype(np.int32), weights.astype(np.float32), friends, user_ids)
+
+def build_graph(users, friends, statuses, shares, reactions, comments, processes = None, chunk_size = 100000, context = None, interner = None):
+    # every worker decays events against the same clock
+    context = context or RankingContext()
+    names, user_ids, intern, status_authors, friend_keys = index_users(users, friends, statuses, interner)
+
+    partials = []
+    if interner is not None:
+        # stores interned against the interner's tables never go through strings or entity objects
+        author_ids = np.frombuffer(interner.status_authors, dtype = np.int32)
+        interned = lambda events: isinstance(events, EventStore) and events.users is interner.users and events.status_ids is interner.statuses
+        if interned(shares):
+            partials.append(accumulate_store(shares, author_ids, context))
+            shares = ()
+        if interned(reactions):
+            partials.append(accumulate_store(reactions, author_ids, context))
+            reactions = ()
+
+    def chunks():
+        chunk = []
+        for user, status_id, weight, time in iter_events(shares, reactions, comments):
+            chunk.append((intern(user), status_id, weight, time))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    if processes:
+        with Pool(processes, initializer = _init_worker, initargs = (status_authors, context)) as pool:
+            partials.extend(pool.imap_unordered(_accumulate_chunk, chunks()))
+    else:
+        partials.extend(accumulate_events(chunk, status_authors, context) for chunk in chunks())
+
+    keys, weights = reduce_edges(np.concatenate([friend_keys] + [keys for keys, _ in partials]),
+                                 np.concatenate([np.full(len(friend_keys), FRIEND_WEIGHT)] + [weights for _, weights in partials]))
+    return compact_graph(names, keys, weights, friend_flags(keys, friend_keys), user_ids)
+
+def build_graph_external(users, friends, statuses, shares, reactions, comments, memory_budget = 256 * 1024 * 1024, partitions = None,
+                         directory = None, context = None, edge_estimate = None):
+    # out-of-core build for event streams larger than memory: events are decayed into fixed size chunks, every chunk is
+    # reduced and appended as a run to the on-disk partition of its key range, then the partitions are reduced one at a time;
+    # shares, reactions and comments can be any iterables, e.g. the parse_files streams, and are read exactly once
+    context = context or RankingContext()
+    names, user_ids, intern, status_authors, friend_keys = index_users(users, friends, statuses)
+    # keys and weights take 16 bytes per event, reducing a chunk needs about four times that;
+    # a partition is split further once it holds more distinct edges than a chunk
+    chunk_size = max(1024, memory_budget // 64)
+    if partitions is None:
+        # edge_estimate is an upper bound on the distinct edges, e.g. the number of events
+        partitions = min(4096, max(1, -(-(edge_estimate or 0) // chunk_size)))
+    # partitions hold contiguous key ranges, so the reduced partitions concatenate in key order; users first seen in an
+    # event are interned after the ranges are drawn, so the last range is open-ended and takes all of their edges
+    key_end = max(1, len(names)) << 32
+    bounds = [key_end * partition // partitions for partition in range(partitions)] + [np.iinfo(np.int64).max]
+
+    def write_runs(records, paths, bounds):
+        # appends the sorted records to the files of the key ranges they fall into
+        positions = np.searchsorted(records["key"], bounds)
+        for index, path in enumerate(paths):
+            if positions[index] < positions[index + 1]:
+                with open(path, "ab") as file:
+                    file.write(records[positions[index]:positions[index + 1]].tobytes())
+
+    def reduce_partition(path, low, high):
+        # sums the friendships and runs of a key range into its distinct edges; a range with more distinct edges
+        # than a chunk is split into narrower ranges instead of being held in memory
+        in_range = slice(*np.searchsorted(friend_keys, [low, high]))
+        keys, weights = friend_keys[in_range], np.full(in_range.stop - in_range.start, FRIEND_WEIGHT)
+        if not os.path.exists(path):
+            return [(keys, weights.astype(np.float32))]
+        overflow = False
+        with open(path, "rb") as file:
+            while not overflow:
+                records = np.fromfile(file, dtype = EDGE_RECORD, count = chunk_size)
+                if not len(records):
+                    break
+                keys, weights = reduce_edges(np.concatenate([keys, records["key"]]), np.concatenate([weights, records["weight"]]))
+                overflow = len(keys) > chunk_size and high - low > 1
+        if not overflow:
+            os.remove(path)
+            return [(keys, weights.astype(np.float32))]
+
+        del keys, weights
+        splits = min(high - low, max(2, -(-os.path.getsize(path) // (EDGE_RECORD.itemsize * chunk_size))))
+        split_bounds = [low + (high - low) * split // splits for split in range(splits + 1)]
+        split_paths = [f"{path}.{split}" for split in range(splits)]
+        with open(path, "rb") as file:
+            while True:
+                records = np.fromfile(file, dtype = EDGE_RECORD, count = chunk_size)
+                if not len(records):
+                    break
+                records.sort(order = "key")
+                write_runs(records, split_paths, split_bounds)
+        os.remove(path)
+        pieces = []
+        for split, split_path in enumerate(split_paths):
+            pieces.extend(reduce_partition(split_path, split_bounds[split], split_bounds[split + 1]))
+        return pieces
+
+    with tempfile.TemporaryDirectory(dir = directory) as runs:
+        paths = [os.path.join(runs, f"partition-{partition}.bin") for partition in range(partitions)]
+        buffer = np.empty(chunk_size, dtype = EDGE_RECORD)
+
+        def spill(count):
+            keys, weights = reduce_edges(buffer["key"][:count], buffer["weight"][:count])
+            records = np.empty(len(keys), dtype = EDGE_RECORD)
+            records["key"], records["weight"] = keys, weights
+            write_runs(records, paths, bounds)
+
+        count = 0
+        for user, status_id, weight, time in iter_events(shares, reactions, comments):
+            buffer[count] = (intern(user) << 32 | status_authors[status_id], weight / context.edge_decay(time))
+            count += 1
+            if count == chunk_size:
+                spill(count)
+                count = 0
+        if count:
+            spill(count)
+        del buffer
+
+        # every reduced range is kept as the CSR columns it ends up in, 13 bytes per edge instead of the 16 of its keys and weights
+        sources, indices, weights, flags = [], [], [], []
+        # every user is interned by now, the open-ended range is closed at the last of them before it is split
+        bounds[-1] = max(bounds[-2] + 1, len(names) << 32)
+        for partition, path in enumerate(paths):
+            for keys, partition_weights in reduce_partition(path, bounds[partition], bounds[partition + 1]):
+                sources.append((keys >> 32).astype(np.int32))
+                indices.append((keys & 0xffffffff).astype(np.int32))
+                weights.append(partition_weights)
+                flags.append(friend_flags(keys, friend_keys))
+    indptr = np.searchsorted(np.concatenate(sources), np.arange(len(names) + 1)).astype(np.int64)
+    return CompactGraph(names, indptr, np.concatenate(indices), np.concatenate(weights), np.concatenate(flags), user_ids)
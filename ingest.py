@@ -0,0 +1,104 @@
+from entities.status import Status
+from entities.comment import Comment
+from entities.share import Share
+from entities.reaction import Reaction
+from entities.event_store import EventStore
+from graph_builder import REACTION_WEIGHTS
+from ranking import RankingContext
+
+REACTION_COUNTERS = {"likes": "like_count", "loves": "num_loves", "wows": "num_wows", "hahas": "num_hahas", "sads": "num_sads", "angrys": "num_angrys"}
+
+class Ingestor(object):
+    def __init__(self, graph, friends, statuses, shares, reactions, comments, trie, feed_index = None, cache = None, interner = None):
+        self.graph = graph
+        self.friends = friends
+        self.statuses = statuses
+        self.shares = shares
+        self.reactions = reactions
+        self.comments = comments
+        self.trie = trie
+        self.feed_index = feed_index
+        self.cache = cache
+        # the Interner the share and reaction stores were interned against, new statuses are added to it
+        self.interner = interner
+
+    def add_interaction(self, user1, user2, weight, time, context):
+        weight /= context.edge_decay(time)
+        edge = self.graph.get_edge_data(user1, user2)
+        if edge is None:
+            reverse_edge = self.graph.get_edge_data(user2, user1)
+            is_friend = user2 in self.friends.get(user1, ()) or (reverse_edge is not None and reverse_edge['friends'])
+            self.graph.add_edge(user1, user2, weight = weight, friends = is_friend)
+        else:
+            edge['weight'] += weight
+
+    def check(self, events):
+        # the whole batch is checked before any event is applied, so a bad event leaves the graph, stores and caches untouched
+        new_statuses = set()
+        for event in events:
+            if isinstance(event, Status):
+                new_statuses.add(event.id)
+            elif isinstance(event, (Share, Reaction, Comment)):
+                if event.status_id not in self.statuses and event.status_id not in new_statuses:
+                    raise KeyError(f"Event for unknown status {event.status_id}")
+                if isinstance(event, Reaction) and event.type not in REACTION_WEIGHTS:
+                    raise ValueError(f"Unknown reaction type {event.type}")
+            else:
+                raise TypeError(f"Unsupported event type: {type(event).__name__}")
+
+    def apply(self, events, context = None):
+        context = context or RankingContext()
+        events = list(events)
+        self.check(events)
+        changed_statuses = {}
+        changed_users = set()
+        new_statuses = False
+
+        for event in events:
+            if isinstance(event, Status):
+                self.statuses[event.id] = event
+                if self.interner is not None:
+                    self.interner.add_status(event)
+                self.graph.add_node(event.author)
+                self.trie.insert_status(event)
+                changed_statuses[event.id] = event
+                new_statuses = True
+                continue
+
+            if isinstance(event, Share):
+                user, group, status = event.sharer, self.shares, self.statuses[event.status_id]
+                status.share_count += 1
+                self.add_interaction(user, status.author, 2.0, event.share_time, context)
+            elif isinstance(event, Reaction):
+                user, group, status = event.reactor, self.reactions, self.statuses[event.status_id]
+                status.reaction_count += 1
+                if event.type in REACTION_COUNTERS:
+                    setattr(status, REACTION_COUNTERS[event.type], getattr(status, REACTION_COUNTERS[event.type]) + 1)
+                self.add_interaction(user, status.author, REACTION_WEIGHTS[event.type], event.reaction_time, context)
+            else:
+                user, group, status = event.author, self.comments, self.statuses[event.status_id]
+                status.comment_count += 1
+                self.add_interaction(user, status.author, 1.0, event.publish_time, context)
+                if self.trie.index_comments:
+                    self.trie.insert_document(event)
+
+            if isinstance(group, EventStore):
+                group.append(event)
+            elif user not in group:
+                group[user] = [event]
+            else:
+                group[user].append(event)
+            changed_statuses[status.id] = status
+            changed_users.add(user)
+
+        if self.feed_index is not None:
+            for status in changed_statuses.values():
+                self.feed_index.update_status(status)
+            self.feed_index.invalidate(changed_users)
+        if self.cache is not None:
+            # edges changed only for the reacting users, new statuses can show up in anyone's search results
+            self.cache.invalidate(changed_users)
+            self.cache.invalidate_statuses(changed_statuses)
+            if new_statuses:
+                self.cache.invalidate(kinds = ("search", "phrase", "autocomplete"))
+        return changed_users
@@ -0,0 +1,181 @@
+import collections
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+from entities.highlighter import Highlighter
+from entities.trie import Trie
+from feed import FeedIndex
+from graph_builder import CompactGraph
+from snapshot import SnapshotTrie
+
+# module level functions that are wrapped wherever they are found, by name, and the stage they are reported under
+FUNCTIONS = {"create_graph": "graph_build", "create_graph_external": "graph_build", "build_graph": "graph_build",
+             "build_graph_external": "graph_build", "add_friend_affinities": "graph_build",
+             "calculate_status_weight": "scoring", "edgerank": "scoring",
+             "print_status": "render", "format_status": "render"}
+METHODS = [(Trie, "__init__", "index_build"), (Trie, "search_word", "search"), (Trie, "search_query", "search"),
+           (Trie, "search_exact_query", "search"), (Trie, "search_prefix", "search"), (Trie, "autocomplete", "search"),
+           (Trie, "personal_autocomplete", "search"), (SnapshotTrie, "search_prefix", "search"), (SnapshotTrie, "autocomplete", "search"),
+           (SnapshotTrie, "personal_autocomplete", "search"),
+           (FeedIndex, "refresh", "scoring"), (FeedIndex, "get_feed", "scoring"),
+           (CompactGraph, "get_edge_data", "graph"),
+           (Highlighter, "spans", "highlight")]
+
+class Metrics(object):
+    # nothing is wrapped until install() is called, so disabled metrics cost the hot paths nothing
+    def __init__(self):
+        self.enabled = False
+        self.timers = {}
+        self.counters = {}
+        self.patches = []
+        # the server records from its executor threads, updates and reads of the timers and counters hold the lock
+        self.lock = threading.Lock()
+
+    def record(self, stage, name, seconds):
+        with self.lock:
+            timer = self.timers.get((stage, name))
+            if timer is None:
+                self.timers[(stage, name)] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def count(self, name, value = 1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {key: list(timer) for key, timer in self.timers.items()}, dict(self.counters)
+
+    @contextlib.contextmanager
+    def timing(self, stage, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, name, time.perf_counter() - start)
+
+    def stage(self, stage, name = None):
+        return self.timing(stage, name or stage) if self.enabled else contextlib.nullcontext()
+
+    def timed(self, function, stage, name):
+        clock = time.perf_counter
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, name, clock() - start)
+        wrapper.__wrapped_stage__ = stage
+        return wrapper
+
+    def patch(self, owner, attribute, stage, name):
+        original = owner.__dict__[attribute]
+        if hasattr(original, "__wrapped_stage__"):
+            return
+        setattr(owner, attribute, self.timed(original, stage, name))
+        self.patches.append((owner, attribute, original))
+
+    def install(self, modules = ()):
+        # modules are the namespaces the functions are looked up in, e.g. main and anything that imported from it
+        if not self.enabled:
+            # networkx is imported here rather than with the module, so importing metrics stays cheap when they are off
+            import networkx as nx
+            for cls, method, stage in METHODS + [(nx.DiGraph, "get_edge_data", "graph")]:
+                # inherited methods are wrapped on the class that defines them, e.g. networkx Graph for DiGraph
+                owner = next(owner for owner in cls.__mro__ if method in owner.__dict__)
+                self.patch(owner, method, stage, f"{cls.__name__}.{method}")
+            self.enabled = True
+        for module in modules:
+            for function, stage in FUNCTIONS.items():
+                if callable(getattr(module, function, None)):
+                    self.patch(module, function, stage, function)
+
+    def uninstall(self):
+        for owner, attribute, original in reversed(self.patches):
+            setattr(owner, attribute, original)
+        self.patches = []
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def dump(self):
+        timers, counters = self.snapshot()
+        stages = {}
+        for (stage, name), (count, total, longest) in sorted(timers.items()):
+            stages.setdefault(stage, {})[name] = {"calls": count, "seconds": total, "max_seconds": longest}
+        return {"stages": stages, "counters": counters}
+
+    def prometheus(self, prefix = "edgerank"):
+        lines = [f"# HELP {prefix}_seconds Time spent in instrumented functions, nested calls are included in their callers.",
+                 f"# TYPE {prefix}_seconds summary"]
+        timers, counters = self.snapshot()
+        for (stage, name), (count, total, _) in sorted(timers.items()):
+            labels = f'stage="{stage}",function="{name}"'
+            lines.append(f"{prefix}_seconds_count{{{labels}}} {count}")
+            lines.append(f"{prefix}_seconds_sum{{{labels}}} {total:.9f}")
+        lines.append(f"# TYPE {prefix}_seconds_max gauge")
+        for (stage, name), (_, _, longest) in sorted(timers.items()):
+            lines.append(f'{prefix}_seconds_max{{stage="{stage}",function="{name}"}} {longest:.9f}')
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        with open(path, "w") as file:
+            if path.endswith(".prom"):
+                file.write(self.prometheus())
+            else:
+                json.dump(self.dump(), file, indent = 2)
+
+class SamplingProfiler(object):
+    # samples the stack of one thread from a background thread and counts collapsed stacks, the format flame graph tools read
+    def __init__(self, interval = 0.005, thread_id = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target = self.sample, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def write(self, path):
+        with open(path, "w") as file:
+            file.write(self.collapsed())
+
+METRICS = Metrics()
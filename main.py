@@ -1,17 +1,22 @@
+import time
+IMPORT_START = time.perf_counter()
 import csv
+import heapq
+import itertools
+import os
+import sys
 import colorama
-import networkx as nx
-from datetime import datetime
-import pickle
-from functools import reduce
-from tabulate import tabulate
-import copy
 import parse_files
-from entities.status import Status
-from entities.comment import Comment
-from entities.share import Share
-from entities.reaction import Reaction
 from entities.trie import Trie
+from entities.event_store import Interner
+from entities.highlighter import Highlighter, highlight_spans
+from feed import FeedIndex
+from result_cache import ResultCache
+from graph_builder import build_graph, build_graph_external
+from ranking import RankingContext
+from snapshot import Snapshot, SnapshotTrie, write_snapshot
+from instrumentation import METRICS, SamplingProfiler
+IMPORT_TIME = time.perf_counter() - IMPORT_START
 
 users = set()
 friends = {}
@@ -19,26 +24,23 @@ statuses = {}
 shares = {}
 reactions = {}
 comments = {}
+# dense ids for users and statuses, shares and reactions are kept as integer columns interned against it
+interner = Interner()
 
-def calculate_status_weight(status):
+def calculate_status_weight(status, context = None):
+    context = context or RankingContext()
     weight = 0
     weight += status.comment_count*1.0 + status.share_count*2.0 + status.like_count*0.5 + status.num_loves*1.0 + status.num_wows*1.5 + status.num_hahas*0.5 * status.num_sads*0.25 + status.num_angrys*0.25
-    difference = (datetime.now() - status.publish_time).days
-    if difference < 1:
-        time_decay = 1
-    elif difference < 3:
-        time_decay = 5*difference
-    else:
-        time_decay = 20*difference
-    weight /= time_decay
+    weight /= context.status_decay(status)
     return weight
 
-def edgerank(status):
-    rank = calculate_status_weight(status)
-    edge = graph.get_edge_data(name, status.author)
+def edgerank(status, user, user_graph, context = None):
+    context = context or RankingContext()
+    rank = calculate_status_weight(status, context)
+    edge = user_graph.get_edge_data(user, status.author)
     if edge is not None:
-        rank += graph.get_edge_data(name, status.author)['weight']
-    rank /= max(1, (datetime.now() - status.publish_time).days)
+        rank += edge['weight']
+    rank /= context.status_edge_decay(status)
     return rank
 
 def load_users(path):
@@ -53,70 +55,77 @@ def load_users(path):
             friends[row[0]] = row[2:]
     return users, friends
 
-def create_graph():
-    graph = nx.DiGraph()
-    graph.add_nodes_from(users)
+def create_graph(processes = None, context = None):
+    return build_graph(users, friends, statuses, shares, reactions, comments, processes = processes, context = context, interner = interner).to_networkx()
 
-    for user in friends:
-        for friend in friends[user]:
-            graph.add_edge(user, friend, weight = 3.0, friends = True)
-            graph.add_edge(friend, user, weight = 3.0, friends = True)
+def create_graph_external(share_paths, reaction_paths, comment_paths, memory_budget, context = None):
+    # events are streamed from the csv files straight into on-disk runs instead of the shares, reactions and comments dicts;
+    # the graph stays a CompactGraph, a networkx graph would cost about a hundred times its memory
+    chain = itertools.chain.from_iterable
+    # every event row takes at least 64 bytes of csv, which bounds the number of distinct edges
+    edge_estimate = sum(os.path.getsize(path) for path in share_paths + reaction_paths + comment_paths) // 64
+    return build_graph_external(users, friends, statuses, chain(map(parse_files.stream_shares, share_paths)), chain(map(parse_files.stream_reactions, reaction_paths)),
+                                chain(map(parse_files.stream_comments, comment_paths)), memory_budget, context = context, edge_estimate = edge_estimate)
 
-    for share in reduce(lambda x, y: x + y, shares.values()):
-        user1 = share.sharer
-        user2 = statuses[share.status_id].author
-        if graph.get_edge_data(user1, user2) is None:
-            graph.add_edge(user1, user2, weight = 2.0 / max(1, (datetime.now() - share.share_time).days), friends = False)
-        else:
-            graph.get_edge_data(user1, user2)['weight'] += 2.0 / max(1, (datetime.now() - share.share_time).days)
-        if user2 in friends[user1] or (graph.get_edge_data(user2, user1) is not None and graph.get_edge_data(user2, user1)['friends']):
-            graph.get_edge_data(user1, user2)['friends'] = True
-    
-    reaction_weights = {"likes": 0.5, "loves": 1.0, "wows": 1.5, "hahas": 0.5, "sads": 0.25, "angrys": 0.75, "special": 0}
-    for reaction in reduce(lambda x, y: x + y, reactions.values()):
-        user1 = reaction.reactor
-        user2 = statuses[reaction.status_id].author
-
-        if graph.get_edge_data(user1, user2) is None:
-            graph.add_edge(user1, user2, weight = reaction_weights[reaction.type] / max(1, (datetime.now() - reaction.reaction_time).days), friends = False)
-        else:
-            graph.get_edge_data(user1, user2)['weight'] += reaction_weights[reaction.type] / max(1, (datetime.now() - reaction.reaction_time).days)
-        if user2 in friends[user1] or (graph.get_edge_data(user2, user1) is not None and graph.get_edge_data(user2, user1)['friends']):
-            graph.get_edge_data(user1, user2)['friends'] = True
-
-    for comment in reduce(lambda x, y: x + y, comments.values()):
-        user1 = comment.author
-        user2 = statuses[comment.status_id].author
-        if graph.get_edge_data(user1, user2) is None:
-            graph.add_edge(user1, user2, weight = 1.0 / max(1, (datetime.now() - comment.publish_time).days), friends = False)
-        else:
-            graph.get_edge_data(user1, user2)['weight'] += 1.0 / max(1, (datetime.now() - comment.publish_time).days)
-        if user2 in friends[user1] or (graph.get_edge_data(user2, user1) is not None and graph.get_edge_data(user2, user1)['friends']):
-            graph.get_edge_data(user1, user2)['friends'] = True
+def add_friend_affinities(graph, max_fan_out = None):
+    # the graph is changed in place and returned, callers that need the original edges pass a copy
+    adjacency = {}
+    for node in graph.nodes:
+        edges = [(node2, data['weight']) for node2, data in graph[node].items() if node2 != node]
+        if max_fan_out is not None and len(edges) > max_fan_out:
+            edges = sorted(edges, key = lambda edge: edge[1], reverse = True)[:max_fan_out]
+        adjacency[node] = edges
 
-    return graph
+    # friend lists are cut to the max_fan_out strongest edges before they are expanded,
+    # so a hub costs max_fan_out squared paths instead of its degree squared
+    strongest = friends
+    if max_fan_out is not None:
+        strongest = {}
+        for user, user_friends in friends.items():
+            if len(user_friends) > max_fan_out:
+                edges = graph.adj[user] if user in graph else {}
+                user_friends = heapq.nlargest(max_fan_out, user_friends, key = lambda friend: edges[friend]['weight'] if friend in edges else 0)
+            strongest[user] = user_friends
 
-def add_friend_affinities(graph):
-    graph_copy = copy.deepcopy(graph)
+    # adjacency holds the original weights, so additions can be written into the graph right away
     for node in graph.nodes:
-        for friend in friends[node]:
-            for node2 in graph.neighbors(friend):
-                if node2 != node and node2 != friend:
-                    if graph_copy.get_edge_data(node, node2) is None:
-                        graph_copy.add_edge(node, node2, weight = graph.get_edge_data(friend, node2)['weight']/1000, friends = False)
-                    else:
-                        graph_copy.get_edge_data(node, node2)['weight'] += graph.get_edge_data(friend, node2)['weight']/1000
-
-            for ff in friends[friend]:
-                for node2 in graph.neighbors(ff):
-                    if node2 != node and node2 != ff:
-                        if graph_copy.get_edge_data(node, node2) is None:
-                            graph_copy.add_edge(node, node2, weight = graph.get_edge_data(ff, node2)['weight']/1000, friends = False)
-                        else:
-                            graph_copy.get_edge_data(node, node2)['weight'] += graph.get_edge_data(ff, node2)['weight']/1000
-    return graph_copy
+        # number of friend and friend of friend paths from the node to every intermediate user,
+        # so each intermediate's edges are visited once per node instead of once per path
+        paths = {}
+        for friend in strongest.get(node, ()):
+            paths[friend] = paths.get(friend, 0) + 1
+            for ff in strongest.get(friend, ()):
+                paths[ff] = paths.get(ff, 0) + 1
+        if max_fan_out is not None and len(paths) > max_fan_out:
+            paths = dict(sorted(paths.items(), key = lambda path: path[1], reverse = True)[:max_fan_out])
+
+        weights = {}
+        for intermediate, count in paths.items():
+            for node2, weight in adjacency.get(intermediate, ()):
+                if node2 != node:
+                    weights[node2] = weights.get(node2, 0) + count * weight / 1000
+
+        edges = dict(graph.adj[node])
+        new_edges = []
+        for node2, weight in weights.items():
+            edge = edges.get(node2)
+            if edge is None:
+                new_edges.append((node, node2, {'weight': weight, 'friends': False}))
+            else:
+                edge['weight'] += weight
+        graph.add_edges_from(new_edges)
+    return graph
+
+def snapshot_is_fresh(path, sources):
+    # a snapshot written after every file it was built from can be loaded instead of re-parsing them
+    if not os.path.exists(path):
+        return False
+    written = os.path.getmtime(path)
+    return all(os.path.exists(source) and os.path.getmtime(source) < written for source in sources)
 
 def format_status(status):
+    # tabulate is only needed here, so it is not imported with the module
+    from tabulate import tabulate
     status_data = [
         ["Message", f"{status.message[:160]}{colorama.Style.RESET_ALL}..."],
         ["Author", status.author],
@@ -128,78 +137,88 @@ def format_status(status):
     table = tabulate(status_data, headers=["", "New Post"], tablefmt="fancy_grid")
     return table
 
-def print_status(status):
-    print(f"Message: {status.message}\nAuthor: {status.author}\nPublish Time: {status.publish_time}\nReactions: {status.reaction_count}\nComments: {status.comment_count}\nShares: {status.share_count}\n\n------\n")
+def print_status(status, message = None):
+    message = status.message if message is None else message
+    print(f"Message: {message}\nAuthor: {status.author}\nPublish Time: {status.publish_time}\nReactions: {status.reaction_count}\nComments: {status.comment_count}\nShares: {status.share_count}\n\n------\n")
 
 if __name__ == "__main__":
     colorama.init()
+    # EDGERANK_METRICS=path.json|path.prom times the hot paths, EDGERANK_PROFILE=path samples stacks for a flame graph
+    metrics_path = os.environ.get("EDGERANK_METRICS")
+    profile_path = os.environ.get("EDGERANK_PROFILE")
+    # EDGERANK_MEMORY_BUDGET_MB builds the graph out of core, events are never loaded into memory
+    memory_budget = os.environ.get("EDGERANK_MEMORY_BUDGET_MB")
+    status_paths = ["dataset/original_statuses.csv", "dataset/test_statuses.csv"]
+    share_paths = ["dataset/original_shares.csv", "dataset/test_shares.csv"]
+    reaction_paths = ["dataset/original_reactions.csv", "dataset/test_reactions.csv"]
+    comment_paths = ["dataset/original_comments.csv", "dataset/test_comments.csv"]
+    if metrics_path:
+        METRICS.install([sys.modules[__name__]])
+    profiler = SamplingProfiler().start() if profile_path else None
 
-    users, friends = load_users("dataset/friends.csv")
-
-    for row in parse_files.load_statuses("dataset/original_statuses.csv"):
-        status = Status(row[0], row[1], row[2], row[3], datetime.strptime(row[4], "%Y-%m-%d %H:%M:%S"), row[5], int(row[6]), int(row[7]), int(row[8]), int(row[9]), int(row[10]), int(row[11]), int(row[12]), int(row[13]), int(row[14]))
-        statuses[status.id] = status
-    for row in parse_files.load_statuses("dataset/test_statuses.csv"):
-        status = Status(row[0], row[1], row[2], row[3], datetime.strptime(row[4], "%Y-%m-%d %H:%M:%S"), row[5], int(row[6]), int(row[7]), int(row[8]), int(row[9]), int(row[10]), int(row[11]), int(row[12]), int(row[13]), int(row[14]))
-        statuses[status.id] = status
-    
-
-    for row in parse_files.load_shares("dataset/original_shares.csv"):
-        share = Share(row[0], row[1], datetime.strptime(row[2], "%Y-%m-%d %H:%M:%S"))
-        if share.sharer not in shares:
-            shares[share.sharer] = [share]
-        else:
-            shares[share.sharer].append(share)
-    for row in parse_files.load_shares("dataset/test_shares.csv"):
-        share = Share(row[0], row[1], datetime.strptime(row[2], "%Y-%m-%d %H:%M:%S"))
-        if share.sharer not in shares:
-            shares[share.sharer] = [share]
-        else:
-            shares[share.sharer].append(share)
+    snapshot_path = "pickles/test/snapshot.bin"
+    # the whole session ranks against one clock
+    context = RankingContext()
 
+    # EDGERANK_REBUILD=1 re-parses the csv files even when the snapshot is newer than all of them
+    snapshot = None
+    if not os.environ.get("EDGERANK_REBUILD") and snapshot_is_fresh(snapshot_path, ["dataset/friends.csv"] + status_paths + share_paths + reaction_paths + comment_paths):
+        try:
+            with METRICS.stage("load", "snapshot"):
+                snapshot = Snapshot(snapshot_path)
+        except ValueError as error:
+            print(f"Rebuilding the snapshot: {error}", file = sys.stderr)
+    # edge weights are decayed as of the snapshot's clock, a snapshot from an earlier day would rank edges with stale ages
+    if snapshot is not None and (snapshot.now is None or snapshot.now.date() != context.now.date()):
+        print("Rebuilding the snapshot: it was built on an earlier day", file = sys.stderr)
+        snapshot = None
 
-    for row in parse_files.load_reactions("dataset/original_reactions.csv"):
-        reaction = Reaction(row[0], row[1], row[2], datetime.strptime(row[3], "%Y-%m-%d %H:%M:%S"))
-        if reaction.reactor not in reactions:
-            reactions[reaction.reactor] = [reaction]
-        else:
-            reactions[reaction.reactor].append(reaction)
-    for row in parse_files.load_reactions("dataset/test_reactions.csv"):
-        reaction = Reaction(row[0], row[1], row[2], datetime.strptime(row[3], "%Y-%m-%d %H:%M:%S"))
-        if reaction.reactor not in reactions:
-            reactions[reaction.reactor] = [reaction]
-        else:
-            reactions[reaction.reactor].append(reaction)
+    if snapshot is not None:
+        # statuses are ranked against the clock the edges were decayed with
+        context = RankingContext(snapshot.now)
+        users, graph, statuses, trie = snapshot.users, snapshot.graph, snapshot.statuses, SnapshotTrie(snapshot)
+    else:
+        with METRICS.stage("load"):
+            users, friends = load_users("dataset/friends.csv")
+            for user in sorted(users):
+                interner.users.intern(user)
 
+            for path in status_paths:
+                for status in parse_files.stream_statuses(path):
+                    statuses[status.id] = status
+                    interner.add_status(status)
 
-    for row in parse_files.load_comments("dataset/original_comments.csv"):
-        comment = Comment(row[0], row[1], row[2], row[3], row[4], datetime.strptime(row[5], "%Y-%m-%d %H:%M:%S"), int(row[6]), int(row[7]))
-        if comment.author not in comments:
-            comments[comment.author] = [comment]
-        else:
-            comments[comment.author].append(comment)
-    for row in parse_files.load_comments("dataset/test_comments.csv"):
-        comment = Comment(row[0], row[1], row[2], row[3], row[4], datetime.strptime(row[5], "%Y-%m-%d %H:%M:%S"), int(row[6]), int(row[7]))
-        if comment.author not in comments:
-            comments[comment.author] = [comment]
-        else:
-            comments[comment.author].append(comment)
+            if memory_budget is None:
+                shares = interner.share_store()
+                for path in share_paths:
+                    shares.extend(parse_files.stream_shares(path))
 
+                reactions = interner.reaction_store()
+                for path in reaction_paths:
+                    reactions.extend(parse_files.stream_reactions(path))
 
-    graph = create_graph()
-    trie = Trie(statuses.values())
+                for path in comment_paths:
+                    for comment in parse_files.stream_comments(path):
+                        if comment.author not in comments:
+                            comments[comment.author] = [comment]
+                        else:
+                            comments[comment.author].append(comment)
 
-    with open("pickles/test/user_graph.pickle", "wb") as f:
-        pickle.dump(graph, f)
-    
-    data = {"users": users, "friends": friends, "statuses": statuses, "shares": shares, "reactions": reaction, "comments": comments}
-    with open("pickles/test/entities.pickle", "wb") as f:
-        pickle.dump(data, f)
+        if memory_budget is None:
+            graph = create_graph(context = context)
+        else:
+            graph = create_graph_external(share_paths, reaction_paths, comment_paths, int(memory_budget) * 1024 * 1024, context)
+        trie = Trie(statuses.values())
 
-    with open("pickles/test/trie.pickle", "wb") as f:
-        pickle.dump(trie, f)
+        with METRICS.stage("snapshot"):
+            # written next to the final path and moved over it, an interrupted write never looks like a fresh snapshot
+            write_snapshot(snapshot_path + ".tmp", graph, statuses, trie, users, context.now)
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+    feed_index = FeedIndex(graph, statuses, calculate_status_weight, context = context)
+    cache = ResultCache()
+    print(f"Imports took {IMPORT_TIME:.3f}s, ready in {time.perf_counter() - IMPORT_START:.3f}s "
+          f"({'loaded the snapshot' if snapshot is not None else 'rebuilt from the datasets'})", file = sys.stderr)
 
-    
     name = input("Enter a user's name: ").title()
     while name not in users:
         print("User with that name doesnt exist.")
@@ -210,27 +229,38 @@ if __name__ == "__main__":
         try:
             choice = int(input("> "))
             if choice == 1:
-                recommended_statuses = sorted(statuses.values(), key = edgerank, reverse = True)
-                for status in recommended_statuses[:10]:
+                METRICS.count("feed_requests")
+                for status in feed_index.get_feed(name):
                     print_status(status)
             elif choice == 2:
                 query = input("Enter search: ").lower()
+                METRICS.count("search_requests")
                 if query[-1] == '*':
-                    print(", ".join(trie.search_prefix(query[:-1])))
+                    words = cache.get_or_compute(name, "autocomplete", query[:-1],
+                                                 lambda: trie.personal_autocomplete(query[:-1], name, graph))
+                    print(", ".join(words))
                 elif query[0] == '"' and query[-1] == '"':
-                    results = trie.search_exact_query(query[1:-1].lower())
-                    results.sort(key = edgerank, reverse = True)
-                    for result in results[:10]:
-                        print_status(result)
+                    results = cache.get_or_compute(name, "phrase", query[1:-1],
+                                                   lambda: sorted(trie.search_exact_query(query[1:-1]), key = lambda result: edgerank(result[1], name, graph, context), reverse = True),
+                                                   status_ids = lambda results: [status.id for _, status in results])
+                    for spans, status in results[:10]:
+                        print_status(status, highlight_spans(spans, status.message))
                 else:
-                    results = list(trie.search_query(query))
-                    results.sort(key = lambda result: result[0] + edgerank(result[1]), reverse = True)
-                    results = list(map(lambda x: x[1], results))
-                    for result in results[:10]:
-                        print_status(result)
+                    results = cache.get_or_compute(name, "search", query,
+                                                   lambda: sorted(trie.search_query(query), key = lambda result: result[0] + edgerank(result[1], name, graph, context), reverse = True),
+                                                   status_ids = lambda results: [status.id for _, status in results])
+                    highlighter = Highlighter(trie.query_words(query))
+                    for _, status in results[:10]:
+                        print_status(status, highlighter.highlight(status.message))
             elif choice == 3:
                 break
             else:
                 raise Exception
         except:
             pass
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.write(profile_path)
+    if metrics_path:
+        METRICS.write(metrics_path)
@@ -1,6 +1,52 @@
+import csv
+import sys
 from random import randint, random
 from datetime import datetime, timedelta
 import time
+from entities.status import Status
+from entities.comment import Comment
+from entities.share import Share
+from entities.reaction import Reaction
+
+
+def parse_datetime(value):
+    # fromisoformat is implemented in C and covers the "%Y-%m-%d %H:%M:%S" format used in the dataset
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+
+def iter_rows(path):
+    # csv.reader pulls lines from the buffered file lazily and keeps quoted multi-line fields together
+    with open(path, encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield row
+
+
+# ids, names and reaction types repeat across millions of rows, so they are interned to share one string object
+def stream_statuses(path):
+    for row in iter_rows(path):
+        yield Status(sys.intern(row[0]), row[1], sys.intern(row[2]), row[3], parse_datetime(row[4]), sys.intern(row[5]), int(row[6]), int(row[7]),
+                     int(row[8]), int(row[9]), int(row[10]), int(row[11]), int(row[12]), int(row[13]), int(row[14]))
+
+
+def stream_comments(path):
+    for row in iter_rows(path):
+        yield Comment(row[0], sys.intern(row[1]), row[2], row[3], sys.intern(row[4]), parse_datetime(row[5]), int(row[6]), int(row[7]))
+
+
+def stream_shares(path):
+    for row in iter_rows(path):
+        yield Share(sys.intern(row[0]), sys.intern(row[1]), parse_datetime(row[2]))
+
+
+def stream_reactions(path):
+    for row in iter_rows(path):
+        yield Reaction(sys.intern(row[0]), sys.intern(row[1]), sys.intern(row[2]), parse_datetime(row[3]))
 
 
 def load_comments(path):
@@ -0,0 +1,48 @@
+import numpy as np
+from datetime import datetime, timedelta
+from entities.event_store import EPOCH
+
+# time decay of a status by its age in whole days: 1 under a day old, 5 per day under three days, 20 per day after that
+STATUS_DECAYS = [1, 5, 10] + [20*days for days in range(3, 3650)]
+STATUS_DECAY_TABLE = np.array(STATUS_DECAYS, dtype = np.int64)
+
+class RankingContext(object):
+    # one reference clock for a whole ranking pass, every score in it is computed as of the same instant;
+    # status ages are bucketed into whole days once per pass and their decay factors are read from the table
+    def __init__(self, now = None):
+        self.now = now or datetime.now()
+        self.status_ages = {}
+
+    def age(self, time):
+        return (self.now - time).days
+
+    def status_age(self, status):
+        age = self.status_ages.get(status.id)
+        if age is None:
+            age = self.status_ages[status.id] = self.age(status.publish_time)
+        return age
+
+    def status_decay(self, status):
+        age = self.status_age(status)
+        if age < 1:
+            return 1
+        return STATUS_DECAYS[age] if age < len(STATUS_DECAYS) else 20*age
+
+    def edge_decay(self, time):
+        return max(1, self.age(time))
+
+    def status_edge_decay(self, status):
+        return max(1, self.status_age(status))
+
+    def ages(self, seconds):
+        # age for an array of epoch seconds, the integer day division matches timedelta.days
+        now = (self.now - EPOCH) // timedelta(microseconds = 1)
+        return (now - np.asarray(seconds, dtype = np.int64) * 1000000) // 86400000000
+
+    def edge_decays(self, seconds):
+        return np.maximum(1, self.ages(seconds))
+
+    def status_decays(self, seconds):
+        # status_decay for an array of publish times in epoch seconds, ages under a day read the first entry of the table
+        ages = self.ages(seconds)
+        return np.where(ages < len(STATUS_DECAYS), STATUS_DECAY_TABLE[np.clip(ages, 0, len(STATUS_DECAYS) - 1)], 20*ages)
@@ -0,0 +1,115 @@
+import sys
+import time
+from collections import OrderedDict
+
+def estimate_size(value):
+    # rough heap size of a cached result, shared objects inside it are counted again for every entry
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+class CacheEntry(object):
+    __slots__ = ["value", "size", "expires", "status_ids"]
+
+    def __init__(self, value, size, expires, status_ids):
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.status_ids = status_ids
+
+class ResultCache(object):
+    # LRU cache of query results keyed by (user, kind, text, version), entries also expire after ttl seconds;
+    # keys are indexed by user and by the statuses a result was computed from, so changes drop only what they touch
+    def __init__(self, max_entries = 4096, max_bytes = 64 * 1024 * 1024, ttl = 300, sizeof = estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.user_keys = {}
+        self.status_keys = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, user, kind, text, version = None, default = None):
+        key = (user, kind, text, version)
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires <= time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, user, kind, text, value, version = None, status_ids = ()):
+        key = (user, kind, text, version)
+        if key in self.entries:
+            self.remove(key)
+        entry = CacheEntry(value, self.sizeof(value), time.monotonic() + self.ttl, frozenset(status_ids))
+        if entry.size > self.max_bytes:
+            return value
+        self.entries[key] = entry
+        self.size += entry.size
+        self.user_keys.setdefault(user, set()).add(key)
+        for status_id in entry.status_ids:
+            self.status_keys.setdefault(status_id, set()).add(key)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+        return value
+
+    def get_or_compute(self, user, kind, text, compute, version = None, status_ids = None):
+        # status_ids, when given, maps the computed value to the ids of the statuses it depends on
+        missing = object()
+        value = self.get(user, kind, text, version, missing)
+        if value is missing:
+            value = compute()
+            self.put(user, kind, text, value, version, status_ids(value) if status_ids is not None else ())
+        return value
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        keys = self.user_keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.user_keys[key[0]]
+        for status_id in entry.status_ids:
+            keys = self.status_keys[status_id]
+            keys.discard(key)
+            if not keys:
+                del self.status_keys[status_id]
+
+    def invalidate(self, users = None, kinds = None):
+        if users is None:
+            keys = list(self.entries)
+        else:
+            keys = [key for user in users for key in self.user_keys.get(user, ())]
+        for key in keys:
+            if kinds is None or key[1] in kinds:
+                self.remove(key)
+
+    def invalidate_statuses(self, status_ids):
+        for status_id in status_ids:
+            for key in list(self.status_keys.get(status_id, ())):
+                self.remove(key)
+
+    def hit_rate(self):
+        return self.hits / max(1, self.hits + self.misses)
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate(), "evictions": self.evictions, "expirations": self.expirations}
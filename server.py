@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from batch_scoring import status_scores
+from entities.highlighter import Highlighter
+from feed import FeedIndex
+from main import calculate_status_weight
+from ranking import RankingContext
+from result_cache import ResultCache
+from instrumentation import METRICS
+from snapshot import STATUS_COUNTERS, Snapshot, SnapshotTrie
+
+# endpoint -> name of the query parameter holding its text
+ENDPOINTS = {"feed": None, "search": "q", "phrase": "q", "autocomplete": "prefix"}
+# how long the rest of an oversized request is drained before its connection is closed anyway
+LINGER_SECONDS = 1.0
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 414: "URI Too Long", 500: "Internal Server Error"}
+
+def status_json(status):
+    return {"id": status.id, "message": status.message, "author": status.author, "publish_time": status.publish_time.isoformat(),
+            "reactions": status.reaction_count, "comments": status.comment_count, "shares": status.share_count}
+
+class UnknownUserError(LookupError):
+    # raised for a user that is not in the snapshot, any other lookup error in a query is a bug and a 500
+    pass
+
+class QueryEngine(object):
+    # everything a request needs, with the user passed explicitly instead of read from a global
+    def __init__(self, path, k = 10):
+        self.snapshot = Snapshot(path)
+        self.graph = self.snapshot.graph
+        self.trie = SnapshotTrie(self.snapshot)
+        # statuses are ranked against the clock the snapshot's edges were decayed with, the load time for snapshots
+        # that did not record it; one clock per engine also keeps the results consistent with the cache
+        self.context = RankingContext(self.snapshot.now)
+        self.feed_index = FeedIndex(self.graph, self.snapshot.statuses, calculate_status_weight, k, context = self.context)
+        # search results are ranked from the status columns, only the returned page is built into Status objects
+        counters = {column: self.snapshot.arrays[f"statuses.{column}"] for column in STATUS_COUNTERS}
+        self.base_scores, self.decays = status_scores(counters, self.snapshot.arrays["statuses.publish_time"], self.context)
+        self.author_ids = self.snapshot.arrays["statuses.author_id"]
+        self.k = k
+
+    def top_rows(self, rows, scores, user):
+        # the k best rows by their score plus the edgerank of their status for the user
+        rows = np.asarray(rows, dtype = np.int64)
+        user_id = self.graph.user_ids[user]
+        start, end = self.graph.indptr[user_id], self.graph.indptr[user_id + 1]
+        authors, weights = self.graph.indices[start:end], self.graph.weights[start:end]
+        author_ids = self.author_ids[rows]
+        positions = np.minimum(np.searchsorted(authors, author_ids), max(0, len(authors) - 1))
+        edges = np.where(authors[positions] == author_ids, weights[positions], 0) if len(authors) else np.zeros(len(rows))
+        ranks = np.asarray(scores, dtype = np.float64) + self.base_scores[rows] + edges / self.decays[rows]
+        return np.argsort(-ranks, kind = "stable")[:self.k]
+
+    def feed(self, user, text):
+        return [status_json(status) for status in self.feed_index.get_feed(user)]
+
+    def search(self, user, text):
+        words = self.trie.query_words(text)
+        scores = self.snapshot.index.bm25(words)
+        rows, scores = list(scores.keys()), list(scores.values())
+        highlighter = Highlighter(words)
+        results = []
+        for index in self.top_rows(rows, scores, user):
+            status = self.snapshot.status(rows[index])
+            results.append(dict(status_json(status), score = scores[index], highlights = highlighter.spans(status.message)))
+        return results
+
+    def phrase(self, user, text):
+        words = [(offset, self.trie.strip_word(word).lower()) for offset, word in enumerate(text.split())]
+        matches = self.snapshot.index.phrase([(offset, word) for offset, word in words if word])
+        rows = list(matches.keys())
+        return [dict(status_json(self.snapshot.status(rows[index])), highlights = matches[rows[index]])
+                for index in self.top_rows(rows, np.zeros(len(rows)), user)]
+
+    def autocomplete(self, user, text):
+        return self.trie.personal_autocomplete(text, user, self.graph)
+
+    def run(self, kind, user, text):
+        # the same users the CLI accepts, authors that are only graph nodes have no feed or search of their own
+        if user not in self.snapshot.users:
+            raise UnknownUserError(user)
+        return getattr(self, kind)(user, text.lower())
+
+_engine = None
+
+def _init_worker(path, metrics = False):
+    global _engine
+    if metrics:
+        METRICS.install([sys.modules["main"], sys.modules[__name__]])
+    _engine = QueryEngine(path)
+
+def run_query(kind, user, text):
+    return _engine.run(kind, user, text)
+
+class QueryServer(object):
+    def __init__(self, executor, cache = None, version = None):
+        self.executor = executor
+        self.in_flight = {}
+        # results are cached in the serving process, so hits never reach the executor
+        self.cache = cache if cache is not None else ResultCache()
+        self.version = version
+
+    async def query(self, kind, user, text):
+        results = self.cache.get(user, kind, text, self.version)
+        if results is not None:
+            return results
+        # identical requests that arrive while one is being computed wait for the same result
+        key = (kind, user, text)
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, run_query, kind, user, text)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda future: self.finish(key, future))
+        return await asyncio.shield(future)
+
+    def finish(self, key, future):
+        del self.in_flight[key]
+        if not future.cancelled() and future.exception() is None:
+            kind, user, text = key
+            results = future.result()
+            status_ids = [] if kind == "autocomplete" else [result["id"] for result in results]
+            self.cache.put(user, kind, text, results, self.version, status_ids)
+
+    async def respond(self, request_line):
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return 400, {"error": "Malformed request"}
+        url = urlsplit(target)
+        kind = url.path.strip("/")
+        if kind not in ENDPOINTS and kind not in ("stats", "metrics"):
+            return 404, {"error": f"Unknown endpoint {url.path}"}
+        if method != "GET":
+            return 405, {"error": f"Method {method} not allowed"}
+        if kind == "stats":
+            return 200, self.cache.stats()
+        if kind == "metrics":
+            return 200, METRICS.prometheus()
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if "user" not in params or (ENDPOINTS[kind] is not None and ENDPOINTS[kind] not in params):
+            return 400, {"error": "Missing query parameter"}
+        try:
+            return 200, {"results": await self.query(kind, params["user"], params.get(ENDPOINTS[kind]) or "")}
+        except UnknownUserError:
+            return 404, {"error": f"User {params['user']} doesnt exist"}
+        except Exception as error:
+            return 500, {"error": str(error)}
+
+    async def handle(self, reader, writer):
+        # readline raises once a line outgrows the stream's limit, the rest of such a request is never read
+        try:
+            request_line = await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            return await self.send(writer, 414, {"error": "Request line too long"}, reader)
+        try:
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+        except (ValueError, asyncio.LimitOverrunError):
+            return await self.send(writer, 400, {"error": "Header line too long"}, reader)
+        code, body = await self.respond(request_line)
+        await self.send(writer, code, body)
+
+    async def send(self, writer, code, body, unread = None):
+        # unread is the reader of a request that was not read to its end
+        if isinstance(body, str):
+            payload, content_type = body.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            payload, content_type = json.dumps(body).encode("utf-8"), "application/json"
+        # every endpoint only answers GET
+        allow = "Allow: GET\r\n" if code == 405 else ""
+        try:
+            writer.write(f"HTTP/1.1 {code} {REASONS[code]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n{allow}"
+                         f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+            await writer.drain()
+            if unread is not None:
+                # closing with unread input resets the connection, and the client can lose the response with it
+                writer.write_eof()
+                await asyncio.wait_for(self.discard(unread), LINGER_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            writer.close()
+
+    async def discard(self, reader):
+        while await reader.read(65536):
+            pass
+
+async def serve(path, host, port, workers, processes, cache_entries = 4096, cache_ttl = 300, metrics = False):
+    if processes:
+        # worker processes keep their own metrics, /metrics then only covers the serving process
+        executor = ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (path, metrics))
+    else:
+        # threads share the one engine loaded here
+        _init_worker(path, metrics)
+        executor = ThreadPoolExecutor(workers)
+    # the snapshot's modification time versions cached results, a rewritten snapshot never serves stale entries
+    query_server = QueryServer(executor, ResultCache(max_entries = cache_entries, ttl = cache_ttl), os.stat(path).st_mtime_ns)
+    server = await asyncio.start_server(query_server.handle, host, port)
+    print(f"Serving feed, search, phrase, autocomplete, stats and metrics on http://{host}:{port}")
+    with executor:
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve feeds and search over HTTP from an EdgeRank snapshot.")
+    parser.add_argument("--snapshot", default = "pickles/test/snapshot.bin")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--processes", action = "store_true", help = "use a process pool, every worker maps the same snapshot")
+    parser.add_argument("--cache-entries", type = int, default = 4096)
+    parser.add_argument("--cache-ttl", type = float, default = 300, help = "seconds a cached result is served before it is recomputed")
+    parser.add_argument("--metrics", action = "store_true", help = "time the query hot paths and export them on /metrics")
+    args = parser.parse_args()
+    asyncio.run(serve(args.snapshot, args.host, args.port, args.workers, args.processes, args.cache_entries, args.cache_ttl, args.metrics))
@@ -0,0 +1,386 @@
+import json
+import mmap
+import struct
+import numpy as np
+from datetime import datetime
+from entities.status import Status
+from entities.event_store import to_epoch, from_epoch
+from entities.inverted_index import InvertedIndex, encode_postings, encode_positions
+from entities.trie import Trie
+from graph_builder import CompactGraph, from_networkx
+
+MAGIC = b"EDGERANK"
+VERSION = 5
+HEADER = struct.Struct("<8sIQ")
+ALIGNMENT = 64
+STATUS_COUNTERS = ["reaction_count", "comment_count", "share_count", "like_count", "num_loves", "num_wows", "num_hahas", "num_sads", "num_angrys"]
+
+class StringColumn(object):
+    # utf-8 strings packed back to back, with an optional sorted order for lookups by value
+    def __init__(self, offsets, data, order = None):
+        self.offsets = offsets
+        self.data = data
+        self.order = order
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def lower_bound(self, string):
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            if self[self.order[middle]] < string:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, string):
+        position = self.lower_bound(string)
+        if position < len(self.order) and self[self.order[position]] == string:
+            return int(self.order[position])
+        return None
+
+class StringLookup(object):
+    def __init__(self, column):
+        self.column = column
+
+    def __contains__(self, string):
+        return self.column.find(string) is not None
+
+    def __getitem__(self, string):
+        index = self.column.find(string)
+        if index is None:
+            raise KeyError(string)
+        return index
+
+    def get(self, string, default = None):
+        index = self.column.find(string)
+        return default if index is None else index
+
+    def __iter__(self):
+        return iter(self.column)
+
+class MaskedLookup(StringLookup):
+    # the strings of a column whose flag is set
+    def __init__(self, column, mask):
+        super().__init__(column)
+        self.mask = mask
+
+    def __contains__(self, string):
+        index = self.column.find(string)
+        return index is not None and bool(self.mask[index])
+
+    def __iter__(self):
+        for index in np.flatnonzero(self.mask):
+            yield self.column[index]
+
+def pack_buffers(buffers):
+    offsets = np.zeros(len(buffers) + 1, dtype = np.int64)
+    np.cumsum([len(buffer) for buffer in buffers], out = offsets[1:])
+    return [offsets, np.frombuffer(b"".join(buffers), dtype = np.uint8)]
+
+def pack_strings(strings, sortable = False):
+    arrays = pack_buffers([string.encode("utf-8") for string in strings])
+    if sortable:
+        arrays.append(np.array(sorted(range(len(strings)), key = strings.__getitem__), dtype = np.int32))
+    return arrays
+
+def pack_prefix_trie(terms, frequencies, completion_size):
+    # the prefix trie of the sorted terms, nodes numbered depth first from the root's empty prefix; a node keeps its edge
+    # characters and child ids, the range of sorted terms under it and the indexes of its best completion_size terms,
+    # ranked like Trie.rank_completions since a term's index is its alphabetical position
+    children = [[]]
+    parents = [0]
+    ranges = [[0, 0]]
+    completions = [[]]
+    path = [0]
+    previous = ""
+    for index, term in enumerate(terms):
+        common = 0
+        while common < min(len(term), len(previous)) and term[common] == previous[common]:
+            common += 1
+        del path[common + 1:]
+        for char in term[common:]:
+            children[path[-1]].append((ord(char), len(children)))
+            parents.append(path[-1])
+            path.append(len(children))
+            children.append([])
+            ranges.append([index, index])
+            completions.append([])
+        for node in path:
+            ranges[node][1] = index + 1
+        completions[path[-1]].append((-int(frequencies[index]), index))
+        previous = term
+
+    # children are numbered after their parents, so a node's list is complete once the backwards walk reaches it
+    for node in range(len(children) - 1, -1, -1):
+        completions[node] = sorted(completions[node])[:completion_size]
+        if node:
+            completions[parents[node]].extend(completions[node])
+
+    arrays = {}
+    arrays["trie.children.offsets"] = np.zeros(len(children) + 1, dtype = np.int64)
+    np.cumsum([len(edges) for edges in children], out = arrays["trie.children.offsets"][1:])
+    arrays["trie.children.chars"] = np.array([char for edges in children for char, _ in edges], dtype = np.int32)
+    arrays["trie.children.nodes"] = np.array([child for edges in children for _, child in edges], dtype = np.int32)
+    arrays["trie.terms"] = np.array(ranges, dtype = np.int32).reshape(-1)
+    arrays["trie.completions.offsets"] = np.zeros(len(children) + 1, dtype = np.int64)
+    np.cumsum([len(ranked) for ranked in completions], out = arrays["trie.completions.offsets"][1:])
+    arrays["trie.completions.data"] = np.array([index for ranked in completions for _, index in ranked], dtype = np.int32)
+    return arrays
+
+def write_snapshot(path, graph, statuses, trie, users = None, now = None):
+    # users marks which graph nodes are users rather than only authors or event participants, all of them by default;
+    # now is the clock the graph's edge weights were decayed against
+    if not isinstance(graph, CompactGraph):
+        graph = from_networkx(graph)
+    statuses = list(statuses.values())
+    rows = {status.id: row for row, status in enumerate(statuses)}
+
+    arrays = {}
+    arrays["names.offsets"], arrays["names.data"], arrays["names.order"] = pack_strings(list(graph.names), True)
+    if users is not None:
+        arrays["names.users"] = np.array([name in users for name in graph.names], dtype = np.bool_)
+    arrays["graph.indptr"] = np.asarray(graph.indptr, dtype = np.int64)
+    arrays["graph.indices"] = np.asarray(graph.indices, dtype = np.int32)
+    arrays["graph.weights"] = np.asarray(graph.weights, dtype = np.float32)
+    arrays["graph.friends"] = np.asarray(graph.friends, dtype = np.bool_)
+
+    for column in ["id", "message", "type", "link", "author"]:
+        strings = [getattr(status, column) for status in statuses]
+        packed = pack_strings(strings, column == "id")
+        for suffix, array in zip(["offsets", "data", "order"], packed):
+            arrays[f"statuses.{column}.{suffix}"] = array
+    for column in STATUS_COUNTERS:
+        arrays[f"statuses.{column}"] = np.array([getattr(status, column) for status in statuses], dtype = np.int64)
+    arrays["statuses.publish_time"] = np.array([to_epoch(status.publish_time) for status in statuses], dtype = np.int64)
+    # the graph node of every status author, -1 for authors that are not in the graph
+    arrays["statuses.author_id"] = np.array([graph.user_ids.get(status.author, -1) for status in statuses], dtype = np.int32)
+
+    # postings are re-encoded with status rows as doc ids so they line up with the status columns
+    index = trie.index
+    # indexed comments are left out, the snapshot only keeps status documents
+    document_rows = [rows[document.id] if trie.status_of(document) is document else None for document in index.documents]
+    terms = sorted(index.terms)
+    arrays["terms.offsets"], arrays["terms.data"], arrays["terms.order"] = pack_strings(terms, True)
+    postings = []
+    positions = []
+    frequencies = []
+    term_rows = []
+    for term in terms:
+        term_positions = index.positions_list(term)
+        entries = sorted((document_rows[doc_id], hits) for doc_id, hits in term_positions.items() if document_rows[doc_id] is not None)
+        frequencies.append(len(entries))
+        term_rows.append(np.array([row for row, _ in entries], dtype = np.int64))
+        postings.append(encode_postings((row, len(hits)) for row, hits in entries))
+        positions.append(bytearray())
+        for _, hits in entries:
+            encode_positions(hits, positions[-1])
+    arrays["postings.offsets"], arrays["postings.data"] = pack_buffers(postings)
+    arrays["positions.offsets"], arrays["positions.data"] = pack_buffers(positions)
+    arrays["terms.document_frequencies"] = np.array(frequencies, dtype = np.int32)
+    arrays.update(pack_prefix_trie(terms, frequencies, trie.completion_size))
+    # statuses per author and term, keyed by author * len(terms) + term so an author's terms under a prefix are one range
+    authors = arrays["statuses.author_id"][np.concatenate(term_rows)] if terms else np.zeros(0, dtype = np.int32)
+    keys = authors.astype(np.int64) * len(terms) + np.repeat(np.arange(len(terms)), frequencies)
+    arrays["authors.terms.keys"], counts = np.unique(keys[authors >= 0], return_counts = True)
+    arrays["authors.terms.counts"] = counts.astype(np.int32)
+    del term_rows
+    arrays["statuses.length"] = np.zeros(len(statuses), dtype = np.int32)
+    for doc_id, row in enumerate(document_rows):
+        if row is not None:
+            arrays["statuses.length"][row] = index.document_lengths[doc_id]
+
+    sections = {}
+    offset = 0
+    for name, array in arrays.items():
+        sections[name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    toc = json.dumps({"sections": sections, "now": now.isoformat() if now is not None else None}).encode("utf-8")
+    data_start = -(-(HEADER.size + len(toc)) // ALIGNMENT) * ALIGNMENT
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(toc)))
+        file.write(toc)
+        for name, array in arrays.items():
+            file.seek(data_start + sections[name][1])
+            file.write(array.tobytes())
+        file.truncate(data_start + offset)
+
+class StatusTable(object):
+    # read-only statuses dict backed by the snapshot columns; Status objects are built on access
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.ids = snapshot.strings("statuses.id")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, status_id):
+        return self.ids.find(status_id) is not None
+
+    def __getitem__(self, status_id):
+        row = self.ids.find(status_id)
+        if row is None:
+            raise KeyError(status_id)
+        return self.snapshot.status(row)
+
+    def keys(self):
+        return iter(self.ids)
+
+    def values(self):
+        for row in range(len(self)):
+            yield self.snapshot.status(row)
+
+class StatusRows(object):
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot.statuses)
+
+    def __getitem__(self, row):
+        return self.snapshot.status(row)
+
+class BufferColumn(object):
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+class SnapshotIndex(InvertedIndex):
+    # the same postings and scoring code, reading the term dictionary and postings from the mapped file
+    def __init__(self, snapshot, k1 = 1.2, b = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = StringLookup(snapshot.terms)
+        self.postings = BufferColumn(snapshot.arrays["postings.offsets"], snapshot.arrays["postings.data"])
+        self.positions = BufferColumn(snapshot.arrays["positions.offsets"], snapshot.arrays["positions.data"])
+        self.document_frequencies = snapshot.arrays["terms.document_frequencies"]
+        self.documents = StatusRows(snapshot)
+        self.document_lengths = snapshot.arrays["statuses.length"]
+        self.total_length = int(self.document_lengths.sum())
+
+class SnapshotTrie(Trie):
+    # read-only Trie search API over a snapshot, prefixes are walked down the prefix trie stored with the terms
+    def __init__(self, snapshot, completion_size = 10):
+        self.index = snapshot.index
+        self.terms = snapshot.terms
+        self.completion_size = completion_size
+        self.index_comments = False
+        arrays = snapshot.arrays
+        self.child_offsets, self.child_chars, self.child_nodes = arrays["trie.children.offsets"], arrays["trie.children.chars"], arrays["trie.children.nodes"]
+        self.term_ranges = arrays["trie.terms"]
+        self.completion_offsets, self.completion_terms = arrays["trie.completions.offsets"], arrays["trie.completions.data"]
+        self.author_term_keys, self.author_term_counts = arrays["authors.terms.keys"], arrays["authors.terms.counts"]
+        self.document_frequencies = arrays["terms.document_frequencies"]
+
+    def status_of(self, document):
+        return document
+
+    def document_frequency(self, word):
+        return int(super().document_frequency(word))
+
+    def find_node(self, prefix):
+        node = 0
+        for char in prefix:
+            start, end = self.child_offsets[node], self.child_offsets[node + 1]
+            position = start + np.searchsorted(self.child_chars[start:end], ord(char))
+            if position == end or self.child_chars[position] != ord(char):
+                return None
+            node = self.child_nodes[position]
+        return node
+
+    def search_prefix(self, prefix):
+        node = self.find_node(prefix)
+        if node is None:
+            return []
+        return [self.terms[index] for index in range(self.term_ranges[2 * node], self.term_ranges[2 * node + 1])]
+
+    def autocomplete(self, prefix, key = None):
+        # the stored completions are the first completion_size of the ranking, at most the size the snapshot was written with
+        node = self.find_node(prefix)
+        if node is None:
+            return []
+        start = self.completion_offsets[node]
+        end = min(self.completion_offsets[node + 1], start + self.completion_size)
+        words = [self.terms[index] for index in self.completion_terms[start:end]]
+        if key is not None:
+            words.sort(key = key, reverse = True)
+        return words
+
+    def personal_autocomplete(self, prefix, user, graph):
+        # the same ranking as Trie.personal_autocomplete, graph is the snapshot's graph so its node ids are the author ids;
+        # each of the user's authors contributes the key range of its terms under the prefix
+        node = self.find_node(prefix)
+        if node is None:
+            return []
+        low, high = self.term_ranges[2 * node], self.term_ranges[2 * node + 1]
+        candidates = self.completion_terms[self.completion_offsets[node]:self.completion_offsets[node + 1]].astype(np.int64)
+        affinities = np.zeros(len(candidates))
+        user_id = graph.user_ids.get(user)
+        if user_id is not None:
+            start, end = graph.indptr[user_id], graph.indptr[user_id + 1]
+            authors = graph.indices[start:end].astype(np.int64) * len(self.terms)
+            begins = np.searchsorted(self.author_term_keys, authors + low)
+            sizes = np.searchsorted(self.author_term_keys, authors + high) - begins
+            positions = np.repeat(begins - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+            candidates = np.concatenate([candidates, self.author_term_keys[positions] % len(self.terms)])
+            affinities = np.concatenate([affinities, np.repeat(graph.weights[start:end], sizes) * self.author_term_counts[positions]])
+        terms, inverse = np.unique(candidates, return_inverse = True)
+        affinities = np.bincount(inverse, weights = affinities, minlength = len(terms))
+        order = np.lexsort((terms, -self.document_frequencies[terms], -affinities))[:self.completion_size]
+        return [self.terms[index] for index in terms[order]]
+
+class Snapshot(object):
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, toc_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an EdgeRank snapshot")
+        if version != VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}, expected {VERSION}")
+        toc = json.loads(self.buffer[HEADER.size:HEADER.size + toc_length].decode("utf-8"))
+        sections = toc["sections"]
+        # edges were decayed as of this time, None for snapshots that did not record it
+        self.now = datetime.fromisoformat(toc["now"]) if toc.get("now") else None
+        data_start = -(-(HEADER.size + toc_length) // ALIGNMENT) * ALIGNMENT
+        # numpy views straight into the mapped file, nothing is copied onto the heap
+        self.arrays = {name: np.frombuffer(self.buffer, dtype = np.dtype(dtype), count = count, offset = data_start + offset)
+                       for name, (dtype, offset, count) in sections.items()}
+
+        self.names = self.strings("names")
+        self.graph = CompactGraph(self.names, self.arrays["graph.indptr"], self.arrays["graph.indices"], self.arrays["graph.weights"],
+                                  self.arrays["graph.friends"], StringLookup(self.names))
+        self.users = MaskedLookup(self.names, self.arrays["names.users"]) if "names.users" in self.arrays else StringLookup(self.names)
+        self.statuses = StatusTable(self)
+        self.terms = self.strings("terms")
+        self.columns = {column: self.strings(f"statuses.{column}") for column in ["id", "message", "type", "link", "author"]}
+        self.index = SnapshotIndex(self)
+
+    def strings(self, name):
+        return StringColumn(self.arrays[f"{name}.offsets"], self.arrays[f"{name}.data"], self.arrays.get(f"{name}.order"))
+
+    def status(self, row):
+        columns = self.columns
+        counters = [int(self.arrays[f"statuses.{column}"][row]) for column in STATUS_COUNTERS]
+        return Status(columns["id"][row], columns["message"][row], columns["type"][row], columns["link"][row],
+                      from_epoch(int(self.arrays["statuses.publish_time"][row])), columns["author"][row], *counters)
+
+    def search_word(self, word):
+        results = {}
+        for row, frequency in self.index.postings_list(word):
+            status = self.status(row)
+            results[status.id] = [frequency, status]
+        return results